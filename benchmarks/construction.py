@@ -0,0 +1,136 @@
+"""Measure the time and memory taken to construct model instances
+
+Compares a dict-backed model class with the same class built with slots=True, for
+instances created by calling the class, for instances hydrated from rows and for
+hydrated instances given capabilities, as the server does for each search result.
+Instances created by calling the class are also
+measured with the __init__ that model_type generated before its member tables were
+precomputed. Run from the repository root with:
+
+    python benchmarks/construction.py
+
+The Anvil runtime is replaced by the stand-in in tests/stubs.
+"""
+
+import os
+import sys
+import timeit
+import tracemalloc
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in ["tests/stubs", "client_code", "server_code"]:
+    sys.path.insert(0, os.path.join(root, path))
+
+from orm_client.particles import Attribute, model_type  # noqa: E402
+
+INSTANCES = 50_000
+
+
+class Book:
+    title = Attribute()
+    pages = Attribute(required=False, default=0)
+    isbn = Attribute(required=False)
+
+
+def previous_constructor(attributes, relationships):
+    """The __init__ generated by model_type before its tables were precomputed"""
+    # We're just merging dicts here but skulpt doesn't support the ** operator
+    members = attributes.copy()
+    members.update(relationships)
+
+    def init(self, **kwargs):
+        self.uid = kwargs.pop("uid", None)
+
+        # Check that we've received arguments for all required members
+        required_args = [name for name, member in members.items() if member.required]
+        for name in required_args:
+            if name not in kwargs:
+                raise ValueError(f"No argument provided for required {name}")
+
+        # Check that the arguments received match the model and set the instance
+        # attributes if so
+        for name, value in kwargs.items():
+            if name not in members:
+                raise ValueError(
+                    f"{type(self).__name__}.__init__ received an invalid argument: "
+                    f"'{name}'"
+                )
+            else:
+                setattr(self, name, value)
+
+        # Set the default instance attributes for optional members missing from the
+        # arguments
+        for name, member in members.items():
+            if name not in kwargs:
+                setattr(self, name, member.default)
+
+    return init
+
+
+def book_class(slots=False, previous=False):
+    """Return a new model class for books
+
+    Each measurement has a class of its own, as CPython lays out the instances of a
+    class according to those already created.
+    """
+    cls = model_type(type("Book", (), dict(vars(Book))), slots=slots)
+    if previous:
+        cls.__init__ = previous_constructor(cls._attributes, cls._relationships)
+    return cls
+
+
+class Row(dict):
+    """A stand-in data tables row"""
+
+    def get_id(self):
+        return self["uid"]
+
+
+ROWS = [
+    Row(uid=str(n), title="Fluent Python", pages=792, isbn="978-1491946008")
+    for n in range(INSTANCES)
+]
+
+
+def construct(cls):
+    return [cls(title="Fluent Python", isbn="978-1491946008") for _ in range(INSTANCES)]
+
+
+def hydrate(cls):
+    return [cls._from_row(row) for row in ROWS]
+
+
+def hydrate_with_capabilities(cls):
+    instances = hydrate(cls)
+    for instance in instances:
+        instance.update_capability = "update"
+        instance.delete_capability = "delete"
+    return instances
+
+
+def measure(cls, create):
+    seconds = min(timeit.repeat(lambda: create(cls), number=1, repeat=5))
+    tracemalloc.start()
+    instances = create(cls)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del instances
+    return seconds / INSTANCES * 1e6, size / INSTANCES
+
+
+if __name__ == "__main__":
+    print(sys.version)
+    for create, label, options in [
+        (construct, "previous", {"previous": True}),
+        (construct, "dict", {}),
+        (construct, "slots", {"slots": True}),
+        (hydrate, "dict", {}),
+        (hydrate, "slots", {"slots": True}),
+        (hydrate_with_capabilities, "dict", {}),
+        (hydrate_with_capabilities, "slots", {"slots": True}),
+    ]:
+        microseconds, size = measure(book_class(**options), create)
+        print(
+            f"{create.__name__:>25} {label:>8}: {microseconds:.1f}us and "
+            f"{size:.0f} bytes per instance"
+        )
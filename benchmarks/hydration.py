@@ -0,0 +1,138 @@
+"""Measure hydration with and without persistence.hydration_executor
+
+A page of books is hydrated at max_depth=2 from stand-in rows. Each linked row
+sleeps for LATENCY the first time it is read, as a row fetched over an uplink
+connection would. Run from the repository root with:
+
+    python benchmarks/hydration.py
+
+The Anvil runtime is replaced by the stand-in in tests/stubs.
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in ["tests/stubs", "client_code", "server_code"]:
+    sys.path.insert(0, os.path.join(root, path))
+
+from orm_client.particles import Attribute, Relationship, model_type  # noqa: E402
+from orm_server import persistence  # noqa: E402
+
+LATENCY = 0.02
+BOOKS = 100
+AUTHORS = 30
+PUBLISHERS = 5
+TAGS = 10
+WORKERS = 8
+
+
+class Row:
+    """A stand-in data tables row whose columns are fetched on first read"""
+
+    def __init__(self, row_id, lazy=True, **columns):
+        self._row_id = row_id
+        self._columns = columns
+        self._loaded = not lazy
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if not self._loaded:
+                time.sleep(LATENCY)
+                self._loaded = True
+
+    def get_id(self):
+        return self._row_id
+
+    def keys(self):
+        return self._columns.keys()
+
+    def __getitem__(self, name):
+        self._load()
+        return self._columns[name]
+
+
+@model_type
+class Publisher:
+    name = Attribute()
+
+
+@model_type
+class Author:
+    name = Attribute()
+    publisher = Relationship("Publisher")
+
+
+@model_type
+class Tag:
+    name = Attribute()
+
+
+@model_type
+class Book:
+    title = Attribute()
+    author = Relationship("Author")
+    tags = Relationship("Tag", with_many=True)
+
+
+def make_rows():
+    """Return a page of book rows, whose linked rows are all still to be fetched"""
+    publishers = [
+        Row(f"p{n}", uid=f"p{n}", name=f"Publisher {n}") for n in range(PUBLISHERS)
+    ]
+    authors = [
+        Row(
+            f"a{n}",
+            uid=f"a{n}",
+            name=f"Author {n}",
+            publisher=publishers[n % PUBLISHERS],
+        )
+        for n in range(AUTHORS)
+    ]
+    tags = [Row(f"t{n}", uid=f"t{n}", name=f"Tag {n}") for n in range(TAGS)]
+    return [
+        Row(
+            f"b{n}",
+            lazy=False,
+            uid=f"b{n}",
+            title=f"Book {n}",
+            author=authors[n % AUTHORS],
+            tags=[tags[n % TAGS], tags[(n + 1) % TAGS]],
+        )
+        for n in range(BOOKS)
+    ]
+
+
+def summary(books):
+    return [
+        (
+            book.uid,
+            book.author.uid,
+            book.author.publisher.uid,
+            [tag.uid for tag in book.tags],
+        )
+        for book in books
+    ]
+
+
+def hydrate(executor):
+    persistence.hydration_executor = executor
+    rows = make_rows()
+    start = time.perf_counter()
+    books, _ = persistence._hydrate_rows(Book, rows, max_depth=2)
+    return time.perf_counter() - start, summary(books)
+
+
+if __name__ == "__main__":
+    print(f"{BOOKS} books with {AUTHORS + PUBLISHERS + TAGS} linked rows")
+    print(f"{LATENCY * 1000:.0f}ms latency on the first read of each linked row")
+    serial, serial_books = hydrate(None)
+    print(f"  serial: {serial:.2f}s")
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        concurrent, concurrent_books = hydrate(executor)
+    print(f"{WORKERS} workers: {concurrent:.2f}s")
+    assert concurrent_books == serial_books, "The results differ"
@@ -22,22 +22,196 @@
 # SOFTWARE.
 #
 # This software is published at # https://github.com/anvilistas/anvil-orm
+import time
+from copy import copy
+
 from app import model
 
+from . import particles
+
 __version__ = "0.1.18"
 
 
 class Cache:
-    def __init__(self):
-        self._items = {}
+    """A bounded cache of search results
+
+    Entries are keyed by model name, search arguments and max_depth. Once the cache
+    holds max_entries searches, the least recently used is discarded and any entry
+    older than ttl seconds is fetched again.
+
+    Every cached object is also indexed by its model name and uid so that it can be
+    found without a server call. Call use() to have Model.get served from that index.
+    The index holds its own copies of the objects and hands out a fresh copy from each
+    lookup, so that unsaved changes to one are never returned by the next.
+
+    For models which define a version_column, refresh(delta=True) fetches only the
+    changes since the previous refresh and applies them to the cached list in place.
+    """
+
+    def __init__(self, max_entries=50, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (items, timestamp, max_depth, sync token)
+        self._entries = {}
+        # keys, least recently used first
+        self._order = []
+        # model name -> key of its most recent search
+        self._latest = {}
+        # (model name, uid) -> (instance, timestamp, max_depth, key of its search)
+        self._index = {}
+
+    @staticmethod
+    def _key(model_name, max_depth, search_args):
+        return (model_name, max_depth, repr(sorted(search_args.items())))
+
+    @staticmethod
+    def _detached(instance):
+        """Return a copy of an instance which shares no lists with the original"""
+        duplicate = copy(instance)
+        for name in list(instance._attributes) + list(instance._relationships):
+            if name not in instance._deferred:
+                value = getattr(instance, name)
+                if isinstance(value, list):
+                    object.__setattr__(duplicate, name, list(value))
+        return duplicate
+
+    def _index_item(self, instance, timestamp, max_depth, key=None):
+        self._index[(type(instance).__name__, instance.uid)] = (
+            self._detached(instance),
+            timestamp,
+            max_depth,
+            key,
+        )
+
+    def _is_fresh(self, timestamp):
+        return self.ttl is None or time.time() - timestamp < self.ttl
+
+    def _touch(self, key):
+        if key in self._order:
+            self._order.remove(key)
+        self._order.append(key)
 
-    def refresh(self, model_name, max_depth=1, **search_args):
+    def _discard_entry(self, key):
+        items = self._entries.pop(key)[0]
+        self._order.remove(key)
+        model_name = key[0]
+        if self._latest.get(model_name) == key:
+            # Fall back to the model's most recently used remaining search
+            remaining = [other for other in self._order if other[0] == model_name]
+            if remaining:
+                self._latest[model_name] = remaining[-1]
+            else:
+                del self._latest[model_name]
+        for item in items:
+            index_key = (type(item).__name__, item.uid)
+            indexed = self._index.get(index_key)
+            if indexed is not None and indexed[3] == key:
+                del self._index[index_key]
+
+    def use(self):
+        """Serve Model.get calls from this cache where possible"""
+        particles.object_cache = self
+        return self
+
+    @staticmethod
+    def _apply_delta(items, changed, removed):
+        positions = {item.uid: position for position, item in enumerate(items)}
+        for item in changed:
+            if item.uid in positions:
+                items[positions[item.uid]] = item
+            else:
+                items.append(item)
+        removed = set(removed)
+        items[:] = [item for item in items if item.uid not in removed]
+        return items
+
+    def refresh(self, model_name, max_depth=1, delta=False, **search_args):
+        """Run a search on the server and cache its results
+
+        With delta=True, only the changes since the previous refresh are fetched and
+        the cached list is updated in place.
+        """
         model_class = getattr(model, model_name)
-        self._items[model_name] = [o for o in model_class.search(**search_args)]
-        return self._items[model_name]
+        key = self._key(model_name, max_depth, search_args)
+        entry = self._entries.get(key)
+        token = None
+        if delta:
+            since = entry[3] if entry is not None else None
+            changed, removed, token = particles._call(
+                "sync_objects",
+                model_name,
+                model_class.__module__,
+                since,
+                max_depth,
+                **search_args,
+            )
+            if since is None:
+                # The first snapshot is paged like any other search
+                items = [
+                    o for o in model_class.search(max_depth=max_depth, **search_args)
+                ]
+            else:
+                items = self._apply_delta(entry[0], changed, removed)
+            for uid in removed:
+                self._index.pop((model_name, uid), None)
+        else:
+            items = [o for o in model_class.search(max_depth=max_depth, **search_args)]
+
+        if entry is not None:
+            self._discard_entry(key)
+        timestamp = time.time()
+        self._entries[key] = (items, timestamp, max_depth, token)
+        self._touch(key)
+        self._latest[model_name] = key
+        for item in items:
+            self._index_item(item, timestamp, max_depth, key)
+        while len(self._order) > self.max_entries:
+            self._discard_entry(self._order[0])
+        return items
+
+    def search(self, model_name, max_depth=1, **search_args):
+        """Return the cached results of a search, running it if they are missing or
+        expired"""
+        key = self._key(model_name, max_depth, search_args)
+        entry = self._entries.get(key)
+        if entry is not None and self._is_fresh(entry[1]):
+            self._touch(key)
+            self._latest[model_name] = key
+            return entry[0]
+        return self.refresh(model_name, max_depth, **search_args)
+
+    def add(self, instance, max_depth=None):
+        """Index a single object"""
+        if instance is not None:
+            self._index_item(instance, time.time(), max_depth)
+
+    def discard(self, model_name, uid):
+        """Remove a single object from the index"""
+        self._index.pop((model_name, uid), None)
+
+    def discard_model(self, model_name):
+        """Remove every search and every indexed object of a model"""
+        for key in [key for key in self._order if key[0] == model_name]:
+            self._discard_entry(key)
+        for index_key in [key for key in self._index if key[0] == model_name]:
+            del self._index[index_key]
+
+    def lookup(self, model_name, uid, max_depth=None):
+        """Return a copy of a fresh cached object fetched to at least max_depth, or
+        None"""
+        entry = self._index.get((model_name, uid))
+        if entry is None:
+            return None
+        instance, timestamp, cached_depth, _ = entry
+        if not self._is_fresh(timestamp):
+            del self._index[(model_name, uid)]
+            return None
+        if cached_depth is not None and (max_depth is None or max_depth > cached_depth):
+            return None
+        return self._detached(instance)
 
     def __getitem__(self, key):
-        return self._items[key]
+        return self._entries[self._latest[key]][0]
 
     def __setitem__(self, key, value):
         raise ValueError("You can only set the cache using the refresh method")
@@ -0,0 +1,109 @@
+# MIT License
+#
+# Copyright (c) 2020 The Anvil ORM project team members listed at
+# https://github.com/anvilistas/anvil-orm/graphs/contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# This software is published at # https://github.com/anvilistas/anvil-orm
+from . import particles
+
+__version__ = "0.1.18"
+
+
+class Stats:
+    """Counters and timings of the work done by the ORM
+
+    On the client, each server call made by a model class is timed. On the server,
+    the persistence module records its table calls, the rows it hydrates at each
+    depth and the time spent in each callable, in security checks and in minting
+    capabilities.
+
+    Call use() to record everything from then on, or use an instance as a context
+    manager to record the work done within a block. Any Stats already in use when
+    the block starts goes on recording too. A Stats is not shared between threads
+    safely, so in an uplink process, collect from one thread at a time.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        # name -> [calls, total seconds, longest call in seconds]
+        self.timings = {}
+        self._previous = None
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self._previous is not None:
+            self._previous.count(name, n)
+
+    def timing(self, name, seconds):
+        timing = self.timings.get(name)
+        if timing is None:
+            self.timings[name] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+        if self._previous is not None:
+            self._previous.timing(name, seconds)
+
+    def use(self):
+        """Record the work done by the ORM from now on"""
+        particles.instrumentation = self
+        return self
+
+    def reset(self):
+        self.counters = {}
+        self.timings = {}
+
+    def __enter__(self):
+        self._previous = particles.instrumentation
+        particles.instrumentation = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        particles.instrumentation = self._previous
+        self._previous = None
+
+    def summary(self):
+        """Return the counters and, for each timing, its number of calls and its
+        total, mean and longest times in milliseconds"""
+        return {
+            "counters": dict(self.counters),
+            "timings": {
+                name: {
+                    "calls": calls,
+                    "total_ms": total * 1000,
+                    "mean_ms": total * 1000 / calls,
+                    "max_ms": longest * 1000,
+                }
+                for name, (calls, total, longest) in self.timings.items()
+            },
+        }
+
+    def log(self, write=print):
+        """Write one line for each counter and timing, e.g. to the app logs"""
+        for name in sorted(self.counters):
+            write(f"orm {name} count={self.counters[name]}")
+        for name in sorted(self.timings):
+            calls, total, longest = self.timings[name]
+            write(
+                f"orm {name} calls={calls} total_ms={total * 1000:.1f} "
+                f"mean_ms={total * 1000 / calls:.1f} max_ms={longest * 1000:.1f}"
+            )
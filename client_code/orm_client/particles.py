@@ -23,6 +23,7 @@
 #
 # This software is published at # https://github.com/anvilistas/anvil-orm
 import sys
+import time
 
 import anvil.server
 import anvil.users
@@ -68,16 +69,157 @@ class Relationship:
             self.default = []
         self.with_many = with_many
         self.cross_reference = cross_reference
+        self._cls = None
 
     @property
     def cls(self):
-        return getattr(sys.modules[self.__module__], self.class_name)
+        if self._cls is None:
+            self._cls = _model_class(self.__module__, self.class_name)
+        return self._cls
+
+
+# The model classes created by model_type, keyed by module and class name
+model_registry = {}
+
+# An optional recorder of counters and timings, such as an
+# orm_client.instrumentation.Stats, which server calls from model classes and the
+# persistence module's work are recorded by
+instrumentation = None
+
+
+def _call(function_name, *args, **kwargs):
+    """Make a server call, recording its count and time if instrumentation is in
+    use"""
+    if instrumentation is None:
+        return anvil.server.call(function_name, *args, **kwargs)
+    recorder = instrumentation
+    start = time.time()
+    try:
+        return anvil.server.call(function_name, *args, **kwargs)
+    finally:
+        recorder.timing(f"server_call.{function_name}", time.time() - start)
+
+
+def _model_class(module_name, class_name):
+    """Return the model class for the given module and class names"""
+    cls = model_registry.get((module_name, class_name))
+    if cls is None:
+        cls = getattr(sys.modules[module_name], class_name)
+    return cls
+
+
+def _attach_capabilities(results, capabilities):
+    """Attach the capabilities covering a whole page to each of its instances"""
+    if capabilities:
+        update = capabilities.get("update", (None, []))
+        delete = capabilities.get("delete", (None, []))
+        for instance in results:
+            if instance.uid in update[1]:
+                instance.update_capability = update[0]
+            if instance.uid in delete[1]:
+                instance.delete_capability = delete[0]
+    return results
+
+
+def _encode_page(instances):
+    """Encode a page of instances in a compact form for transfer to the client
+
+    Each class, with the members loaded for it, is described once by a header of
+    member names. Each object is then encoded once as a list of its header's index
+    followed by its values. Relationships refer to related objects by their index
+    in the list of rows, so an object referred to by several others is only sent
+    once.
+    """
+    headers = []
+    header_index = {}
+    objects = []
+    object_index = {}
+
+    def ref(instance):
+        if instance is None:
+            return None
+        if id(instance) not in object_index:
+            object_index[id(instance)] = len(objects)
+            objects.append(instance)
+        return object_index[id(instance)]
+
+    results = [ref(instance) for instance in instances]
+    rows = []
+    position = 0
+    while position < len(objects):
+        instance = objects[position]
+        position += 1
+        cls = type(instance)
+        names = ["_row_id"] + [
+            name for name in _member_names(cls) if name not in instance._deferred
+        ]
+        key = (cls.__module__, cls.__name__, tuple(names))
+        if key not in header_index:
+            header_index[key] = len(headers)
+            headers.append([cls.__module__, cls.__name__, names])
+        row = [header_index[key]]
+        for name in names:
+            value = getattr(instance, name)
+            if name in cls._relationships:
+                if isinstance(value, list):
+                    value = [ref(member) for member in value]
+                else:
+                    value = ref(value)
+            row.append(value)
+        rows.append(row)
+    return {"headers": headers, "rows": rows, "results": results}
+
+
+def _decode_page(page):
+    """Recreate the instances of a page encoded by _encode_page"""
+    headers = [
+        (_model_class(module_name, class_name), names)
+        for module_name, class_name, names in page["headers"]
+    ]
+    instances = []
+    for row in page["rows"]:
+        cls = headers[row[0]][0]
+        instances.append(_new_instance(cls))
+
+    for instance, row in zip(instances, page["rows"]):
+        cls, names = headers[row[0]]
+        for name, value in zip(names, row[1:]):
+            if name in cls._relationships:
+                if isinstance(value, list):
+                    value = [instances[index] for index in value]
+                elif value is not None:
+                    value = instances[value]
+            object.__setattr__(instance, name, value)
+
+    # Change tracking starts once every instance has its row id, as the snapshot
+    # of multi relationships records the row ids of related instances
+    for instance, row in zip(instances, page["rows"]):
+        cls, names = headers[row[0]]
+        instance._deferred = [name for name in _member_names(cls) if name not in names]
+        _mark_clean(instance)
+    return [instances[index] for index in page["results"]]
+
+
+def _page_results(results, capabilities):
+    """Prepare a page of search results received from the server"""
+    if isinstance(results, dict):
+        results = _decode_page(results)
+    return _attach_capabilities(_register_partials(results), capabilities)
 
 
 class ModelSearchResultsIterator:
     """A paging iterator over the results of a search cached on the server"""
 
-    def __init__(self, class_name, module_name, rows_id, page_length, max_depth=None):
+    def __init__(
+        self,
+        class_name,
+        module_name,
+        rows_id,
+        page_length,
+        max_depth=None,
+        cursor=False,
+        first_page=None,
+    ):
         self.class_name = class_name
         self.module_name = module_name
         self.rows_id = rows_id
@@ -85,7 +227,13 @@ class ModelSearchResultsIterator:
         self.next_page = 0
         self.is_last_page = False
         self.max_depth = max_depth
+        self.cursor = cursor
+        self.after = None
         self.iterator = iter([])
+        if first_page is not None:
+            results, self.is_last_page, self.after, capabilities = first_page
+            self.iterator = iter(_page_results(results, capabilities))
+            self.next_page = 1
 
     def __next__(self):
         try:
@@ -93,7 +241,7 @@ class ModelSearchResultsIterator:
         except StopIteration:
             if self.is_last_page:
                 raise
-            results, self.is_last_page = anvil.server.call(
+            results, self.is_last_page, self.after, capabilities = _call(
                 "fetch_objects",
                 self.class_name,
                 self.module_name,
@@ -101,18 +249,40 @@ class ModelSearchResultsIterator:
                 self.next_page,
                 self.page_length,
                 self.max_depth,
+                self.after,
             )
-            self.iterator = iter(results)
+            self.iterator = iter(_page_results(results, capabilities))
             self.next_page += 1
             return self.__next__()
 
 
 @anvil.server.serializable_type
 class ModelSearchResults:
-    """A class to provide lazy loading of search results"""
+    """A class to provide lazy loading of search results
+
+    In cursor mode, each page is fetched by a bounded query starting after the last
+    row of the previous page, so deep pages cost the same as the first.
+
+    If the search included its first page, iteration starts from that page without
+    a further server call.
+
+    If the search was made with a lazy count, the number of results is only fetched
+    from the server when first requested.
+
+    If the search was made in compact mode, each page arrives in the encoding of
+    _encode_page and is decoded as it is iterated.
+    """
 
     def __init__(
-        self, class_name, module_name, rows_id, page_length, max_depth, length
+        self,
+        class_name,
+        module_name,
+        rows_id,
+        page_length,
+        max_depth,
+        length,
+        cursor=False,
+        first_page=None,
     ):
         self.class_name = class_name
         self.module_name = module_name
@@ -120,8 +290,12 @@ class ModelSearchResults:
         self.page_length = page_length
         self.max_depth = max_depth
         self._length = length
+        self.cursor = cursor
+        self.first_page = first_page
 
     def __len__(self):
+        if self._length is None:
+            self._length = _call("count_objects", self.rows_id)
         return self._length
 
     def __iter__(self):
@@ -131,51 +305,189 @@ class ModelSearchResults:
             self.rows_id,
             self.page_length,
             self.max_depth,
+            self.cursor,
+            self.first_page,
         )
 
 
+class Query:
+    """A chainable description of a search, which is run on the server
+
+    e.g. Book.query().filter(published_on__gte=date).order_by("-title").limit(10)
+
+    Each filter is either member=value or member__operator=value, where operator is
+    one of ne, gt, gte, lt, lte, like, ilike, in, not_in or full_text_match.
+    Prefixing a member name passed to order_by with '-' sorts it in descending
+    order. Each method returns a new query and the search is made when the query
+    is iterated or its search method called.
+    """
+
+    def __init__(self, cls, filters=None, ordering=None, limit=None):
+        self.cls = cls
+        self._filters = filters or []
+        self._ordering = ordering or []
+        self._limit = limit
+
+    def filter(self, **conditions):
+        filters = list(self._filters)
+        for key, value in conditions.items():
+            name, _, operator = key.partition("__")
+            filters.append([name, operator or "eq", value])
+        return Query(self.cls, filters, self._ordering, self._limit)
+
+    def order_by(self, *names):
+        ordering = self._ordering + [
+            [name.lstrip("-"), not name.startswith("-")] for name in names
+        ]
+        return Query(self.cls, self._filters, ordering, self._limit)
+
+    def limit(self, count):
+        return Query(self.cls, self._filters, self._ordering, count)
+
+    def description(self):
+        """Return the description of the query sent to the server"""
+        return {
+            "filters": self._filters,
+            "order_by": self._ordering,
+            "limit": self._limit,
+        }
+
+    def search(self, **options):
+        """Make the search, with any of the options of the model's search method"""
+        return self.cls.search(query=self.description(), **options)
+
+    def count(self):
+        """Return the number of objects matched by the query"""
+        return self.cls.count(query=self.description())
+
+    def aggregate(self, **options):
+        """Aggregate the objects matched by the query, as the model's aggregate
+        method does"""
+        return self.cls.aggregate(query=self.description(), **options)
+
+    def __iter__(self):
+        return iter(self.search())
+
+
 def attribute_value(self, name, title=None):
     """A factory function to generate AttributeValue instances"""
     value = getattr(self, name, None)
     return AttributeValue(name=name, value=value, title=title)
 
 
-def _constructor(attributes, relationships):
-    """A function to return the __init__ function for the eventual model class"""
+def _populator(attributes, relationships, state=()):
+    """A function to return a function which sets every member of a new instance
+
+    Members missing from the values are set to their defaults. Any state given as
+    (name, value) pairs is set too. A new instance has no changes to record, so
+    everything is set directly rather than through __setattr__.
+    """
     # We're just merging dicts here but skulpt doesn't support the ** operator
     members = attributes.copy()
     members.update(relationships)
+    defaults = [(name, member.default) for name, member in members.items()]
 
-    def init(self, **kwargs):
-        self.uid = kwargs.pop("uid", None)
+    def populate(instance, values):
+        object.__setattr__(instance, "uid", values.get("uid"))
+        for name, default in defaults:
+            object.__setattr__(instance, name, values.get(name, default))
+        for name, value in state:
+            object.__setattr__(instance, name, value)
+
+    return populate
+
+
+def _constructor(attributes, relationships, populate):
+    """A function to return the __init__ function for the eventual model class
+
+    The tables of members and required members are built once for the class rather
+    than on every instantiation.
+    """
+    # We're just merging dicts here but skulpt doesn't support the ** operator
+    members = attributes.copy()
+    members.update(relationships)
+    required = [name for name, member in members.items() if member.required]
 
+    def init(self, **kwargs):
         # Check that we've received arguments for all required members
-        required_args = [name for name, member in members.items() if member.required]
-        for name in required_args:
+        for name in required:
             if name not in kwargs:
                 raise ValueError(f"No argument provided for required {name}")
 
-        # Check that the arguments received match the model and set the instance attributes if so
-        for name, value in kwargs.items():
-            if name not in members:
+        # Check that the arguments received match the model
+        for name in kwargs:
+            if name not in members and name != "uid":
                 raise ValueError(
                     f"{type(self).__name__}.__init__ received an invalid argument: '{name}'"
                 )
-            else:
-                setattr(self, name, value)
 
-        # Set the default instance attributes for optional members missing from the arguments
-        for name, member in members.items():
-            if name not in kwargs:
-                setattr(self, name, member.default)
+        populate(self, kwargs)
 
     return init
 
 
+# The per instance state of a model object and its initial values. Classes created
+# with model_type(slots=True) hold this state in slots, which are set to these
+# values as each instance is created, rather than as class level defaults.
+_INSTANCE_STATE = {
+    "_row_id": None,
+    "_deferred": [],
+    "_changes": None,
+    "_snapshot": {},
+    "update_capability": None,
+    "delete_capability": None,
+    "search_capability": None,
+}
+
+
+def _new_instance(cls):
+    """Create a model instance without calling __init__
+
+    The state slots of a class created with model_type(slots=True) are set, so that
+    reading them never falls through to __getattr__.
+    """
+    instance = cls.__new__(cls)
+    if hasattr(cls, "__slots__"):
+        for name, value in _INSTANCE_STATE.items():
+            object.__setattr__(instance, name, value)
+    return instance
+
+
+def _getstate(self):
+    """A function to return the values held in the slots of an instance
+
+    Slots are read directly so that deferred members are not loaded.
+    """
+    state = {}
+    for name in type(self).__slots__:
+        try:
+            state[name] = object.__getattribute__(self, name)
+        except AttributeError:
+            pass
+    return state
+
+
+def _setstate(self, state):
+    for name, value in state.items():
+        object.__setattr__(self, name, value)
+
+
+def _serialize(self, global_data):
+    return _getstate(self)
+
+
+def _deserialize(self, data, global_data):
+    _setstate(self, data)
+
+
 def _equivalence(self, other):
     """A function to assert equivalence between client and server side copies of model
     instances"""
-    return type(self) == type(other) and self.uid == other.uid
+    if type(self) != type(other):
+        return False
+    if self._row_id is not None and other._row_id is not None:
+        return self._row_id == other._row_id
+    return self.uid == other.uid
 
 
 def _getitem(self, key):
@@ -187,11 +499,251 @@ def _setitem(self, key, value):
     setattr(self, key, value)
 
 
-def _from_row(unique_identifier, attributes, relationships):
-    """A factory function to generate a model instance from a data tables row."""
+# An optional cache, with lookup, add and discard methods, from which Model.get is
+# served where possible
+object_cache = None
+
+# Partial instances received from the server whose deferred members have not yet
+# been loaded. Those of the same class are loaded together when any one of them is
+# first accessed.
+_pending = []
+MAX_PENDING = 1000
+
+
+def _identity(instance):
+    """Return the row id of an instance fetched from the server, or else its uid
+
+    A placeholder's uid is only loaded when first read, but its row id is always
+    known.
+    """
+    if instance._row_id is not None:
+        return instance._row_id
+    return instance.uid
+
+
+def _identities(members):
+    """Return the identities of a list of model instances"""
+    return [_identity(member) for member in members or [] if member is not None]
+
+
+def _setattr(self, name, value):
+    """A function to record which members have changed since the instance was
+    fetched from the server"""
+    if self._changes is not None and (
+        name in self._attributes or name in self._relationships
+    ):
+        if name not in self._changes:
+            object.__setattr__(self, "_changes", list(self._changes) + [name])
+    object.__setattr__(self, name, value)
+
+
+def _take_snapshot(instance, names):
+    """Record the identities of the objects currently held by the given multi
+    relationships"""
+    snapshot = instance._snapshot.copy()
+    for name in names:
+        if instance._relationships[name].with_many:
+            snapshot[name] = _identities(getattr(instance, name))
+    instance._snapshot = snapshot
+
+
+def _mark_clean(self):
+    """A function to start tracking changes to an instance from its current state
+
+    The tracking state is set directly, as it is not itself a tracked change. An
+    empty tuple, shared by every clean instance, stands for no changes.
+    """
+    snapshot = {}
+    for name, relationship in self._relationships.items():
+        if relationship.with_many and name not in self._deferred:
+            snapshot[name] = _identities(getattr(self, name))
+    object.__setattr__(self, "_changes", ())
+    object.__setattr__(self, "_snapshot", snapshot)
+    return self
+
+
+def _changed_members(self):
+    """A function to return the names of the members changed since the instance was
+    fetched from the server, or None if the instance was not fetched
+
+    Lists and dicts held by attributes may have been changed in place and are
+    always included. Multi relationships are compared with the uids they held
+    when fetched.
+    """
+    if self._changes is None:
+        return None
+    changed = set(self._changes)
+    for name in self._attributes:
+        if name not in self._deferred and isinstance(getattr(self, name), (list, dict)):
+            changed.add(name)
+    for name, relationship in self._relationships.items():
+        if relationship.with_many and name not in self._deferred:
+            if _identities(getattr(self, name)) != self._snapshot.get(name):
+                changed.add(name)
+    return changed
+
+
+def _member_names(cls):
+    """Return the names of the members of a model class, with the uid first"""
+    return ["uid"] + [
+        name
+        for name in list(cls._attributes) + list(cls._relationships)
+        if name != "uid"
+    ]
+
+
+def _partial_instance(cls, values, deferred):
+    """Create a model instance with only some of its members set
+
+    The instance is created without calling __init__ and the deferred members are
+    loaded from the server when one of them is first accessed.
+    """
+    instance = _new_instance(cls)
+    for name, value in values.items():
+        object.__setattr__(instance, name, value)
+    object.__setattr__(instance, "_deferred", list(deferred))
+    return _mark_clean(instance)
+
+
+@classmethod
+def _stub(cls, row, identity_map=None):
+    """Create a placeholder instance, holding only its row id, for a data tables row
+
+    The row itself is not read. Its uid is deferred along with every other member.
+    If the row has already been hydrated in the current server call, that instance
+    is used instead.
+    """
+    if row is None:
+        return None
+    row_id = row.get_id()
+    if identity_map is not None and (cls.__name__, row_id) in identity_map:
+        return identity_map[(cls.__name__, row_id)][0]
+    return _partial_instance(cls, {"_row_id": row_id}, _member_names(cls))
+
+
+def _getattr(self, name):
+    """A function to load deferred members from the server on first access"""
+    if name in _INSTANCE_STATE:
+        return _INSTANCE_STATE[name]
+    if name not in self._deferred:
+        raise AttributeError(
+            f"'{type(self).__name__}' object has no attribute '{name}'"
+        )
+    _load_deferred(self)
+    return getattr(self, name)
+
+
+def _register_partials(results):
+    """Record the partial instances reachable from a server response"""
+    global _pending
+    found = []
+    seen = set()
+    stack = list(results)
+    while stack:
+        instance = stack.pop()
+        if instance is None or id(instance) in seen:
+            continue
+        seen.add(id(instance))
+        if instance._deferred:
+            found.append(instance)
+        for name in instance._relationships:
+            if name in instance._deferred:
+                continue
+            value = getattr(instance, name)
+            if isinstance(value, list):
+                stack.extend(value)
+            else:
+                stack.append(value)
+    _pending = (_pending + found)[-MAX_PENDING:]
+    return results
+
+
+def _load_deferred(instance):
+    """Fetch the deferred members of an instance from the server
+
+    Any other pending instances of the same class, with the same deferred members,
+    are loaded by the same server call.
+    """
+    global _pending
+    cls = type(instance)
+    deferred = instance._deferred
+    batch = [
+        other
+        for other in _pending
+        if type(other) is cls and other._deferred == deferred
+    ]
+    if not any(other is instance for other in batch):
+        batch.append(instance)
+
+    # A relationship placeholder, whose uid is deferred, is loaded in full by its
+    # row id
+    if "uid" in deferred:
+        key = "_row_id"
+        loaded = _call(
+            "get_objects",
+            cls.__name__,
+            cls.__module__,
+            [],
+            0,
+            None,
+            True,
+            row_ids=list({other._row_id for other in batch}),
+        )
+    else:
+        key = "uid"
+        loaded = _call(
+            "get_objects",
+            cls.__name__,
+            cls.__module__,
+            [other.uid for other in batch],
+            0,
+            deferred,
+            True,
+        )
+    loaded = {getattr(other, key): other for other in loaded}
+    if getattr(instance, key) not in loaded:
+        raise ValueError(f"Unable to load {cls.__name__} object")
+
+    for other in batch:
+        if getattr(other, key) in loaded:
+            for name in deferred:
+                object.__setattr__(
+                    other, name, getattr(loaded[getattr(other, key)], name)
+                )
+            other._deferred = []
+            _take_snapshot(
+                other, [name for name in deferred if name in cls._relationships]
+            )
+    _pending = [other for other in _pending if other._deferred]
+    _register_partials(loaded.values())
+
+
+def _from_row(unique_identifier, attributes, relationships, populate):
+    """A factory function to generate a model instance from a data tables row.
+
+    An optional identity map, keyed by class name and row id, allows each row to be
+    hydrated only once per server call. The same instance is then shared by every
+    object which refers to it.
+
+    If a list of fields is given, only those members are read from the row and
+    the remainder are deferred until first accessed.
+
+    If lazy_relationships is set, relationships beyond max_depth are set to
+    placeholder instances which load themselves on first access, rather than None.
+    """
+    multiple = [name for name, member in relationships.items() if member.with_many]
 
     @classmethod
-    def instance_from_row(cls, row, cross_references=None, max_depth=None, depth=0):
+    def instance_from_row(
+        cls,
+        row,
+        cross_references=None,
+        max_depth=None,
+        depth=0,
+        identity_map=None,
+        fields=None,
+        lazy_relationships=False,
+    ):
         if anvil.server.context.type == "client":
             raise TypeError(
                 "_from_row is a server side function and cannot be called from client code"
@@ -203,16 +755,30 @@ def _from_row(unique_identifier, attributes, relationships):
         if cross_references is None:
             cross_references = set()
 
-        attrs = dict(row)
-        attrs = {
-            key: value
-            for key, value in attrs.items()
-            if key in attributes or key == "uid"
-        }
-        if "uid" not in attrs:
-            attrs["uid"] = attrs[unique_identifier]
+        # Only the model's columns are read, so that none outside a preload's
+        # fetch_only need be fetched
+        if fields is None:
+            attrs = {name: row[name] for name in attributes}
+        else:
+            attrs = {
+                name: row[name]
+                for name in attributes
+                if name in fields or name == unique_identifier
+            }
+        attrs["uid"] = row["uid"]
+
+        key = (cls.__name__, row.get_id())
+        if identity_map is not None and key in identity_map:
+            # An instance hydrated at the same or a shallower depth has at least as
+            # many levels of relationships as we would build here
+            instance, instance_depth = identity_map[key]
+            if instance_depth <= depth:
+                return instance
 
         for name, relationship in relationships.items():
+            if fields is not None and name not in fields:
+                continue
+
             xref = None
             attrs[name] = None
 
@@ -228,27 +794,99 @@ def _from_row(unique_identifier, attributes, relationships):
             if max_depth is None or depth < max_depth:
                 if not relationship.with_many:
                     attrs[name] = relationship.cls._from_row(
-                        row[name], cross_references, max_depth, depth + 1
+                        row[name],
+                        cross_references,
+                        max_depth,
+                        depth + 1,
+                        identity_map,
+                        lazy_relationships=lazy_relationships,
                     )
                 else:
                     attrs[name] = []
                     if row[name]:
                         attrs[name] = [
                             relationship.cls._from_row(
-                                member, cross_references, max_depth, depth + 1
+                                member,
+                                cross_references,
+                                max_depth,
+                                depth + 1,
+                                identity_map,
+                                lazy_relationships=lazy_relationships,
                             )
                             for member in row[name]
                         ]
-
-        return cls(**attrs)
+            elif lazy_relationships:
+                if not relationship.with_many:
+                    attrs[name] = relationship.cls._stub(row[name], identity_map)
+                else:
+                    attrs[name] = [
+                        relationship.cls._stub(member, identity_map)
+                        for member in row[name] or []
+                    ]
+
+        if fields is not None:
+            deferred = [
+                name
+                for name in list(attributes) + list(relationships)
+                if name not in attrs
+            ]
+            attrs["_row_id"] = key[1]
+            return _partial_instance(cls, attrs, deferred)
+
+        # The row's values need no checking, so __init__ is bypassed. A hydrated
+        # instance starts clean and only multi relationships need a snapshot.
+        instance = cls.__new__(cls)
+        populate(instance, attrs)
+        object.__setattr__(instance, "_row_id", key[1])
+        object.__setattr__(instance, "_changes", ())
+        if multiple:
+            object.__setattr__(
+                instance,
+                "_snapshot",
+                {name: _identities(getattr(instance, name)) for name in multiple},
+            )
+        if identity_map is not None:
+            identity_map[key] = (instance, depth)
+        return instance
 
     return instance_from_row
 
 
 @classmethod
-def _get(cls, uid, max_depth=None):
-    """Provide a method to fetch an object from the server"""
-    return anvil.server.call("get_object", cls.__name__, cls.__module__, uid, max_depth)
+def _get(cls, uid, max_depth=None, preload=None, fields=None, lazy_relationships=False):
+    """Provide a method to fetch an object from the server
+
+    preload is an optional list of relationship paths, e.g. ["author.publisher"],
+    whose rows are fetched in the same query as the object's own row.
+
+    fields is an optional list of member names to fetch. Any others are loaded from
+    the server when first accessed.
+
+    With lazy_relationships=True, relationships beyond max_depth are placeholders
+    which load themselves when first accessed, rather than None.
+
+    If an object cache is in use, a fresh copy of the object held there is returned
+    without a server call.
+    """
+    if object_cache is not None and fields is None:
+        instance = object_cache.lookup(cls.__name__, uid, max_depth)
+        if instance is not None:
+            return instance
+
+    instance = _call(
+        "get_object",
+        cls.__name__,
+        cls.__module__,
+        uid,
+        max_depth,
+        preload,
+        fields,
+        lazy_relationships,
+    )
+    _register_partials([instance])
+    if object_cache is not None and fields is None:
+        object_cache.add(instance, max_depth)
+    return instance
 
 
 @classmethod
@@ -258,34 +896,204 @@ def _search(
     max_depth=None,
     server_function=None,
     with_class_name=True,
+    cursor=False,
+    with_first_page=False,
+    lazy_count=False,
+    preload=None,
+    fields=None,
+    lazy_relationships=False,
+    page_capabilities=False,
+    compact=False,
+    query=None,
     **search_args,
 ):
-    """Provides a method to retrieve a set of model instances from the server"""
+    """Provides a method to retrieve a set of model instances from the server
+
+    With cursor=True, results are ordered by unique identifier and paged using a
+    keyset cursor rather than by offset.
+
+    With with_first_page=True, the first page of results is returned along with
+    the search, saving a round trip when iteration begins.
+
+    With lazy_count=True, the search results are only counted if len() is called
+    on them.
+
+    preload is an optional list of relationship paths, e.g. ["author.publisher"],
+    whose rows are fetched in the same query as each page of results.
+
+    fields is an optional list of member names to fetch for each result. Any others
+    are loaded from the server when first accessed.
+
+    With lazy_relationships=True, relationships beyond max_depth are placeholders
+    which load themselves when first accessed, rather than None. Placeholders
+    from the same response are loaded together by a single server call.
+
+    With page_capabilities=True, each page carries one update and one delete
+    capability covering all of its objects, rather than two for every object.
+
+    With compact=True, each page is sent as a header of member names per class and
+    a list of values per object, with each related object sent only once. Compact
+    pages always carry page capabilities.
+
+    query is an optional description of filters, ordering and a limit, as made by
+    Model.query(), which is applied by the table search on the server.
+    """
     _server_function = server_function or "basic_search"
-    results = anvil.server.call(
+    results = _call(
         _server_function,
         cls.__name__,
         cls.__module__,
         page_length,
         max_depth,
         with_class_name,
+        cursor=cursor,
+        with_first_page=with_first_page,
+        lazy_count=lazy_count,
+        preload=preload,
+        fields=fields,
+        lazy_relationships=lazy_relationships,
+        page_capabilities=page_capabilities,
+        compact=compact,
+        query=query,
         **search_args,
     )
     return results
 
 
 def _save(self):
-    """Provides a method to persist an instance to the database"""
-    return anvil.server.call("save_object", self)
+    """Provides a method to persist an instance to the database
+
+    Only the members changed since the instance was fetched are written.
+    """
+    result = _call("save_object", self)
+    if self.uid is not None:
+        _mark_clean(self)
+        if object_cache is not None:
+            object_cache.discard(type(self).__name__, self.uid)
+    return result
+
+
+@classmethod
+def _query(cls):
+    """Provides a method to start building a query"""
+    return Query(cls)
+
+
+@classmethod
+def _count(cls, query=None, **search_args):
+    """Provides a method to count the records matching a search on the server"""
+    return cls.aggregate(query=query, **search_args)["count"]
+
+
+@classmethod
+def _aggregate(
+    cls,
+    sum=None,
+    min=None,
+    max=None,
+    avg=None,
+    group_by=None,
+    query=None,
+    **search_args,
+):
+    """Provides a method to aggregate the records matching a search on the server
+
+    sum, min, max and avg each take an attribute name or a list of them, e.g.
+    Order.aggregate(sum="total", group_by="status"). The aggregates are computed
+    from the table rows without creating any model instances.
+
+    Without group_by, returns a dict with the count of records and an entry for each
+    aggregate, e.g. {"count": 12, "sum_total": 340}. With group_by, an attribute or
+    relationship name or a list of them, returns a list of such dicts, one for each
+    group, which also hold the group's values. Related objects in those values are
+    given by uid.
+    """
+    aggregates = []
+    for function, columns in (("sum", sum), ("min", min), ("max", max), ("avg", avg)):
+        if isinstance(columns, str):
+            columns = [columns]
+        aggregates.extend([function, column] for column in columns or [])
+    if isinstance(group_by, str):
+        group_by = [group_by]
+    return _call(
+        "aggregate_objects",
+        cls.__name__,
+        cls.__module__,
+        aggregates,
+        group_by,
+        query,
+        **search_args,
+    )
+
+
+@classmethod
+def _export(cls, export_format="csv", background=False, **options):
+    """Provides a method to export the records matching a search as a file
+
+    export_format is "csv" or "jsonl". options may include fields, a list of the
+    members to export, relationships=False to leave relationships out, a query
+    description and any search arguments. Relationships are exported as the uids of
+    the related objects.
+
+    Returns a Media object or, with background=True, a background task whose
+    return value will be the Media object.
+    """
+    function = "launch_export" if background else "export_objects"
+    return _call(function, cls.__name__, cls.__module__, export_format, **options)
+
+
+@classmethod
+def _save_many(cls, instances):
+    """Provides a method to persist a list of instances with a single server call"""
+    instances = list(instances)
+    result = _call("save_objects", cls.__name__, instances)
+    if object_cache is not None:
+        for instance in instances:
+            if instance.uid is not None:
+                object_cache.discard(cls.__name__, instance.uid)
+    return result
 
 
 def _delete(self):
     """Provides a method to delete an instance from the database"""
-    anvil.server.call("delete_object", self)
+    _call("delete_object", self)
+    if object_cache is not None:
+        object_cache.discard(type(self).__name__, self.uid)
+
+
+@classmethod
+def _delete_many(cls, instances):
+    """Provides a method to delete a list of instances with a single server call"""
+    instances = list(instances)
+    _call("delete_objects", cls.__name__, instances)
+    if object_cache is not None:
+        for instance in instances:
+            object_cache.discard(cls.__name__, instance.uid)
 
 
-def model_type(cls):
-    """A decorator to provide a usable model class"""
+@classmethod
+def _delete_where(cls, **search_args):
+    """Provides a method to delete the records matching a search on the server"""
+    _call("delete_where", cls.__name__, cls.__module__, **search_args)
+    if object_cache is not None:
+        object_cache.discard_model(cls.__name__)
+
+
+def model_type(cls=None, slots=False):
+    """A decorator to provide a usable model class
+
+    With @model_type(slots=True), instances hold their members and their state in
+    __slots__ rather than a __dict__, so each takes a fixed amount of memory. An
+    instance sent from the server with its capabilities then takes about a quarter
+    of the memory of a dict-backed one, though it is a little slower to create and
+    one created directly takes a little more. Such instances cannot be given
+    attributes which are not members of the model, and no member may have the name
+    of a model class method, such as get or save. Having no __dict__, they are
+    copied and serialized through their slots.
+    """
+    if cls is None:
+        return lambda cls: model_type(cls, slots)
+
     class_members = {
         key: value for key, value in cls.__dict__.items() if not key.startswith("__")
     }
@@ -317,28 +1125,70 @@ def model_type(cls):
     for relationship in relationships.values():
         relationship.__module__ = cls.__module__
 
+    # Slots hold the per instance state, so it is set on each new instance
+    state = list(_INSTANCE_STATE.items()) if slots else []
+    populate = _populator(attributes, relationships, state)
     members = {
         "__module__": cls.__module__,
-        "__init__": _constructor(attributes, relationships),
+        "__init__": _constructor(attributes, relationships, populate),
         "__eq__": _equivalence,
+        "__getattr__": _getattr,
+        "__setattr__": _setattr,
         "__getitem__": _getitem,
         "__setitem__": _setitem,
         "_attributes": attributes,
         "_relationships": relationships,
-        "_from_row": _from_row(unique_identifier, attributes, relationships),
+        "_from_row": _from_row(unique_identifier, attributes, relationships, populate),
         "_unique_identifier": unique_identifier,
+        "_row_id": None,
+        "_deferred": [],
+        "_changes": None,
+        "_snapshot": {},
+        "_changed_members": _changed_members,
+        "_mark_clean": _mark_clean,
+        "_stub": _stub,
+        "version_column": None,
         "update_capability": None,
         "delete_capability": None,
         "search_capability": None,
         "attribute_value": attribute_value,
         "get": _get,
         "search": _search,
+        "query": _query,
+        "count": _count,
+        "aggregate": _aggregate,
+        "export": _export,
         "save": _save,
+        "save_many": _save_many,
         "expunge": _delete,
         "delete": _delete,
+        "delete_many": _delete_many,
+        "delete_where": _delete_where,
     }
+    if slots:
+        for name in _INSTANCE_STATE:
+            del members[name]
+        names = ["uid"] + [
+            name for name in list(attributes) + list(relationships) if name != "uid"
+        ]
+        for name in names:
+            if name in members:
+                raise AttributeError(
+                    f"{cls.__name__}.{name} cannot be held in a slot, as it has the "
+                    "name of a model class method"
+                )
+        members.update(
+            {
+                "__slots__": names + list(_INSTANCE_STATE),
+                "__getstate__": _getstate,
+                "__setstate__": _setstate,
+                "__serialize__": _serialize,
+                "__deserialize__": _deserialize,
+            }
+        )
     members.update(methods)
     members.update(class_attributes)
 
-    model = type(cls.__name__, (object,), members)
-    return anvil.server.portable_class(model)
+    model = anvil.server.portable_class(type(cls.__name__, (object,), members))
+    model_registry[(cls.__module__, cls.__name__)] = model
+    return model
@@ -0,0 +1,168 @@
+# MIT License
+
+# Copyright (c) 2020 The Anvil ORM project team members listed at
+# https://github.com/anvilistas/anvil-orm/graphs/contributors
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# This software is published at # https://github.com/anvilistas/anvil-orm
+from collections import OrderedDict
+from copy import copy
+from time import monotonic
+
+__version__ = "0.1.18"
+
+
+class ObjectCache:
+    """A cache of hydrated model instances held by a server process
+
+    Entries are keyed by class name, uid and max_depth. Instances are stored without
+    their capabilities and a copy is returned from each hit so that capabilities can
+    be attached for the current user.
+
+    Every entry records the objects embedded within it through its relationships, so
+    that invalidating an object also invalidates every entry which embeds it.
+
+    Only saves and deletes made through this process invalidate entries. A write
+    made by another server process or uplink is not seen here until the entry
+    expires, ttl seconds after it was cached. Set ttl to None to keep entries
+    until they are invalidated or evicted.
+    """
+
+    def __init__(self, max_entries=1000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # (class name, uid, max_depth) -> (instance, embedded object keys, cached at)
+        self._entries = OrderedDict()
+        # (class name, uid) -> keys of the entries for that object
+        self._keys_by_object = {}
+        # (class name, uid) -> keys of the entries which embed that object
+        self._dependents = {}
+
+    @staticmethod
+    def _embedded(instance):
+        """Return the keys of the objects reachable through an instance's
+        relationships"""
+        embedded = set()
+        seen = set()
+        stack = [instance]
+        while stack:
+            current = stack.pop()
+            if current is None or id(current) in seen:
+                continue
+            seen.add(id(current))
+            if current is not instance and "uid" not in current._deferred:
+                embedded.add((type(current).__name__, current.uid))
+            for name in current._relationships:
+                if name in current._deferred:
+                    continue
+                value = getattr(current, name)
+                if isinstance(value, list):
+                    stack.extend(value)
+                else:
+                    stack.append(value)
+        return embedded
+
+    def use(self):
+        """Have persistence read and invalidate objects through this cache"""
+        from . import persistence
+
+        persistence.object_cache = self
+        return self
+
+    def get(self, class_name, uid, max_depth):
+        """Return a copy of a cached instance, or None"""
+        key = (class_name, uid, max_depth)
+        entry = self._entries.get(key)
+        if entry is not None and self._expired(entry):
+            self._discard(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return copy(entry[0])
+
+    def put(self, class_name, uid, max_depth, instance):
+        """Cache an instance, without its capabilities"""
+        key = (class_name, uid, max_depth)
+        if key in self._entries:
+            self._discard(key)
+        instance = copy(instance)
+        instance.update_capability = None
+        instance.delete_capability = None
+        embedded = self._embedded(instance)
+        self._entries[key] = (instance, embedded, monotonic())
+        for object_key in {(class_name, uid), (class_name, instance.uid)}:
+            self._keys_by_object.setdefault(object_key, set()).add(key)
+        for object_key in embedded:
+            self._dependents.setdefault(object_key, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._discard(next(iter(self._entries)))
+
+    def _expired(self, entry):
+        return self.ttl is not None and monotonic() - entry[2] > self.ttl
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        instance, embedded, _ = entry
+        for object_key in {(key[0], key[1]), (key[0], instance.uid)}:
+            self._forget(self._keys_by_object, object_key, key)
+        for object_key in embedded:
+            self._forget(self._dependents, object_key, key)
+
+    @staticmethod
+    def _forget(index, object_key, key):
+        """Remove an entry's key from an index, and the object's keys once empty"""
+        keys = index.get(object_key)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[object_key]
+
+    def invalidate(self, class_name, uid):
+        """Remove an object and every entry which embeds it"""
+        object_key = (class_name, uid)
+        keys = self._keys_by_object.pop(object_key, set())
+        keys |= self._dependents.pop(object_key, set())
+        for key in keys:
+            self._discard(key)
+
+    def invalidate_class(self, class_name):
+        """Remove every object of a class and every entry which embeds one"""
+        object_keys = [
+            object_key
+            for object_key in list(self._keys_by_object) + list(self._dependents)
+            if object_key[0] == class_name
+        ]
+        for object_key in object_keys:
+            self.invalidate(*object_key)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_object.clear()
+        self._dependents.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
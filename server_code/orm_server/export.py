@@ -0,0 +1,223 @@
+# MIT License
+
+# Copyright (c) 2020 The Anvil ORM project team members listed at
+# https://github.com/anvilistas/anvil-orm/graphs/contributors
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# This software is published at # https://github.com/anvilistas/anvil-orm
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import date, datetime
+from itertools import islice
+
+import anvil.media
+import anvil.server
+import anvil.tables.query as q
+
+from .persistence import (
+    _class_permitted,
+    _count,
+    _decisions,
+    _get_class,
+    _permitted,
+    _request_scoped,
+    _search_arguments,
+    get_table,
+)
+
+__version__ = "0.1.18"
+
+# The formats in which a search can be exported, with their content types
+EXPORT_FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+# The number of rows read, checked and written at a time
+CHUNK_SIZE = 1000
+
+
+def _columns(cls, fields=None, relationships=True):
+    """Return the names of the members to export, with the uid first
+
+    If fields are given, only those members are exported, whether or not they are
+    relationships.
+    """
+    members = list(cls._attributes) + list(cls._relationships)
+    if fields is not None:
+        unknown = set(fields) - set(members)
+        if unknown:
+            raise ValueError(
+                f"{cls.__name__} has no member named {', '.join(sorted(unknown))}"
+            )
+        names = [name for name in members if name in fields]
+    elif relationships:
+        names = members
+    else:
+        names = list(cls._attributes)
+    return ["uid"] + [name for name in names if name != "uid"]
+
+
+def _value(cls, name, value):
+    """Return a column value as written to an export
+
+    Linked rows are replaced by their uids.
+    """
+    if name in cls._relationships:
+        if cls._relationships[name].with_many:
+            return [row["uid"] for row in value or []]
+        return value["uid"] if value is not None else None
+    return value
+
+
+def _text(value):
+    """Return a value as a string for a CSV file"""
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return " ".join(str(member) for member in value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _format_chunk(records, columns, export_format, with_header):
+    """Return a chunk of records as text in the given format"""
+    if export_format == "jsonl":
+        return "".join(
+            json.dumps(dict(zip(columns, record)), default=_json_default) + "\n"
+            for record in records
+        )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if with_header:
+        writer.writerow(columns)
+    writer.writerows([_text(value) for value in record] for record in records)
+    return buffer.getvalue()
+
+
+def export_chunks(
+    class_name,
+    module_name,
+    export_format="csv",
+    fields=None,
+    relationships=True,
+    chunk_size=CHUNK_SIZE,
+    query=None,
+    **search_args,
+):
+    """Generate the export of a search as chunks of text
+
+    Rows are read straight from the table, fetching only the exported columns, and
+    chunk_size of them are held at a time, so the rows and their objects are never all
+    in memory together. Relationships are exported as the uids of the related objects,
+    or left out if relationships is False. Rows the user may not read are omitted.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{export_format}'")
+    if not _class_permitted("search", class_name):
+        raise ValueError("You do not have permission to search these objects")
+    cls = _get_class(class_name, module_name)
+    columns = _columns(cls, fields, relationships)
+    linked = {
+        name: q.fetch_only("uid") for name in columns if name in cls._relationships
+    }
+    fetched = [name for name in columns if name not in linked]
+    if cls._unique_identifier not in fetched:
+        fetched.append(cls._unique_identifier)
+    search_definition = {"search_args": search_args, "query": query}
+    args, kwargs = _search_arguments(cls, search_definition)
+    _count("table.search")
+    rows = iter(
+        get_table(class_name).search(q.fetch_only(*fetched, **linked), *args, **kwargs)
+    )
+    if query is not None and query.get("limit") is not None:
+        rows = islice(rows, query["limit"])
+
+    with_header = True
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        readable = _permitted(
+            "read", class_name, [row[cls._unique_identifier] for row in chunk]
+        )
+        records = [
+            [_value(cls, name, row[name]) for name in columns]
+            for row in chunk
+            if row[cls._unique_identifier] in readable
+        ]
+        yield _format_chunk(records, columns, export_format, with_header)
+        with_header = False
+        # The decisions for rows already written are not needed again and would
+        # otherwise grow with the export
+        _decisions("read", class_name).clear()
+    if with_header and export_format == "csv":
+        yield _format_chunk([], columns, export_format, with_header)
+
+
+def _export_media(class_name, module_name, export_format, **options):
+    """Write the export of a search to a temporary file and return it as Media
+
+    The finished file is read back into the Media object, which holds the whole
+    export in memory.
+    """
+    chunks = export_chunks(class_name, module_name, export_format, **options)
+    handle, path = tempfile.mkstemp(suffix=f".{export_format}")
+    try:
+        with os.fdopen(handle, "w", newline="") as export_file:
+            for chunk in chunks:
+                export_file.write(chunk)
+        return anvil.media.from_file(
+            path, EXPORT_FORMATS[export_format], f"{class_name}.{export_format}"
+        )
+    finally:
+        os.remove(path)
+
+
+@anvil.server.callable
+@_request_scoped
+def export_objects(class_name, module_name, export_format="csv", **options):
+    """Return the export of a search as a Media object"""
+    return _export_media(class_name, module_name, export_format, **options)
+
+
+@anvil.server.background_task
+@_request_scoped
+def export_objects_task(class_name, module_name, export_format="csv", **options):
+    """Export a search as a background task, returning the Media object"""
+    return _export_media(class_name, module_name, export_format, **options)
+
+
+@anvil.server.callable
+def launch_export(class_name, module_name, export_format="csv", **options):
+    """Start an export in a background task and return the task
+
+    The Media object is the task's return value once it has completed.
+    """
+    return anvil.server.launch_background_task(
+        "export_objects_task", class_name, module_name, export_format, **options
+    )
@@ -24,23 +24,57 @@
 # This software is published at # https://github.com/anvilistas/anvil-orm
 import functools
 import re
+import threading
 from copy import copy
+from datetime import datetime, timedelta, timezone
 from importlib import import_module
+from itertools import islice
+from time import perf_counter
 from uuid import uuid4
 
 import anvil.server
+import anvil.tables
 import anvil.tables.query as q
 import anvil.users
 from anvil.server import Capability
-from anvil.tables import app_tables
+from anvil.tables import app_tables, order_by
 
-from orm_client.particles import ModelSearchResults
+from orm_client import particles
+from orm_client.particles import ModelSearchResults, _encode_page, model_registry
 
 from . import security
 
 __version__ = "0.1.18"
 camel_pattern = re.compile(r"(?<!^)(?=[A-Z])")
 
+# The table in which deletions are recorded for classes with a version_column.
+# It needs text columns 'class_name' and 'uid' and a datetime column 'deleted_at'.
+TOMBSTONE_TABLE = "orm_tombstone"
+
+# How far before the start of a sync its token is set. A save stamps its version
+# column before its write lands, so a save stamped just before a sync began may only
+# be visible after the sync's search. Objects changed within the margin are sent
+# again by the next sync, which is harmless as they replace the cached copies.
+SYNC_OVERLAP = timedelta(seconds=30)
+
+# An optional cache of hydrated objects, such as an orm_server.cache.ObjectCache,
+# which get_object and fetch_objects read through and which saves and deletes
+# invalidate
+object_cache = None
+
+# An optional concurrent.futures executor, e.g. ThreadPoolExecutor(max_workers=8),
+# with which the rows linked from a page of results are loaded concurrently before
+# the page is hydrated. This helps most in uplink processes, where every table call
+# has network latency.
+hydration_executor = None
+
+# The number of search definitions kept in the server session before the oldest
+# are discarded
+MAX_STORED_SEARCHES = 50
+
+# The compiled schemas of the model classes in use, keyed by class name
+_schemas = {}
+
 
 # def caching_query(search_function):
 #     """A decorator to stash the results of a data tables search."""
@@ -60,15 +94,58 @@ camel_pattern = re.compile(r"(?<!^)(?=[A-Z])")
 def caching_query(search_function):
     """A decorator to stash the results of a data tables search."""
 
+    @_request_scoped
     @functools.wraps(search_function)
     def wrapper(
-        class_name, module_name, page_length, max_depth, with_class_name, **search_args
+        class_name,
+        module_name,
+        page_length,
+        max_depth,
+        with_class_name,
+        cursor=False,
+        with_first_page=False,
+        lazy_count=False,
+        preload=None,
+        fields=None,
+        lazy_relationships=False,
+        page_capabilities=False,
+        compact=False,
+        query=None,
+        **search_args,
     ):
-        length = len(get_table(class_name).search(**search_args))
-        if with_class_name:
-            search_args["class_name"] = class_name
-        rows_id = uuid4().hex
-        anvil.server.session[rows_id] = search_args
+        cls = _get_class(class_name, module_name)
+        search_definition = {
+            "class_name": class_name,
+            "module_name": module_name,
+            "search_args": search_args,
+            "query": query,
+        }
+        # Compiling the query here raises any error in it before the search is kept
+        args, kwargs = _search_arguments(cls, search_definition)
+        if cursor and args:
+            raise ValueError("A search ordered by a query cannot be paged by cursor")
+        length = None
+        if not lazy_count:
+            _count("table.search")
+            length = _limited(
+                len(get_table(class_name).search(*args, **kwargs)), search_definition
+            )
+        search_definition.update(
+            {
+                "cursor": cursor,
+                "preload": preload,
+                "fields": fields,
+                "lazy_relationships": lazy_relationships,
+                "page_capabilities": page_capabilities,
+                "compact": compact,
+            }
+        )
+        rows_id = _store_search(search_definition)
+        first_page = None
+        if with_first_page:
+            first_page = fetch_objects(
+                class_name, module_name, rows_id, 0, page_length, max_depth
+            )
         return ModelSearchResults(
             class_name,
             module_name,
@@ -76,50 +153,601 @@ def caching_query(search_function):
             page_length=page_length,
             max_depth=max_depth,
             length=length,
+            cursor=cursor,
+            first_page=first_page,
         )
 
     return wrapper
 
 
+def _store_search(search_definition):
+    """Keep a search definition in the server session and return its key
+
+    Only the most recent searches are kept so that the session cannot grow without
+    limit.
+    """
+    rows_id = uuid4().hex
+    search_ids = anvil.server.session.get("orm_search_ids", []) + [rows_id]
+    for expired_id in search_ids[:-MAX_STORED_SEARCHES]:
+        anvil.server.session.pop(expired_id, None)
+    anvil.server.session["orm_search_ids"] = search_ids[-MAX_STORED_SEARCHES:]
+    anvil.server.session[rows_id] = search_definition
+    return rows_id
+
+
+def _load_search(rows_id):
+    """Return a search definition from the server session"""
+    return anvil.server.session.get(rows_id, None)
+
+
 def _camel_to_snake(name):
     """Convert a CamelCase string to snake_case"""
     return camel_pattern.sub("_", name).lower()
 
 
+def _compile(cls):
+    """Return the compiled schema of a model class, compiling it if necessary
+
+    The schema holds the class and its table, so that neither need be looked up
+    again.
+    """
+    schema = _schemas.get(cls.__name__)
+    if schema is None or schema["cls"] is not cls:
+        schema = {
+            "cls": cls,
+            "table": getattr(app_tables, _camel_to_snake(cls.__name__)),
+        }
+        _schemas[cls.__name__] = schema
+    return schema
+
+
+def compile_models(module_name):
+    """Compile the schemas of the model classes in a module and check their tables
+
+    Call this at the top of a server module to have each table checked for the
+    columns its class needs once, when the server starts, rather than to find a
+    missing column part way through a request.
+    """
+    import_module(module_name)
+    classes = [cls for key, cls in model_registry.items() if key[0] == module_name]
+    for cls in classes:
+        schema = _compile(cls)
+        columns = {column["name"] for column in schema["table"].list_columns()}
+        required = {"uid"} | set(cls._attributes) | set(cls._relationships)
+        missing = required - columns
+        if missing:
+            raise ValueError(
+                f"The table for {cls.__name__} has no column named "
+                f"{', '.join(sorted(missing))}"
+            )
+        for relationship in cls._relationships.values():
+            _compile(relationship.cls)
+    return {cls.__name__: _schemas[cls.__name__] for cls in classes}
+
+
 def get_table(class_name):
-    """Return the data tables table for the given class name"""
+    """Return the data tables table for the given class name
+
+    The schema of a registered model class of that name is compiled on first use.
+    """
+    schema = _schemas.get(class_name)
+    if schema is None:
+        classes = [cls for key, cls in model_registry.items() if key[1] == class_name]
+        if len(classes) == 1:
+            schema = _compile(classes[0])
+    if schema is not None:
+        return schema["table"]
     table_name = _camel_to_snake(class_name)
     return getattr(app_tables, table_name)
 
 
-def _get_row(class_name, module_name, uid):
+def _get_row(class_name, module_name, uid, preload=None, fields=None):
     """Return the data tables row for for a given object instance"""
-    table = getattr(app_tables, _camel_to_snake(class_name))
-    module = import_module(module_name)
-    cls = getattr(module, class_name)
+    cls = _get_class(class_name, module_name)
     search_kwargs = {cls._unique_identifier: uid}
-    return table.get(**search_kwargs)
+    _count("table.get")
+    return get_table(class_name).get(
+        *_fetch_only_queries(cls, preload, fields), **search_kwargs
+    )
+
+
+def _path_tree(paths):
+    """Convert a list of dotted relationship paths to a nested dict
+
+    e.g. ["author", "author.publisher", "editor"] becomes
+    {"author": {"publisher": {}}, "editor": {}}
+    """
+    tree = {}
+    for path in paths:
+        branch = tree
+        for name in path.split("."):
+            branch = branch.setdefault(name, {})
+    return tree
+
+
+def _fetch_only(cls, tree, fields=None):
+    """Return a q.fetch_only clause for a class and a tree of relationships
+
+    The columns of the class's table (or only those named in fields) are fetched
+    along with the full rows of the relationships in the tree.
+    """
+    unknown = set(tree) - set(cls._relationships)
+    if unknown:
+        raise ValueError(
+            f"{cls.__name__} has no relationship named {', '.join(sorted(unknown))}"
+        )
+
+    columns = ["uid"] + [
+        name
+        for name in cls._attributes
+        if name != "uid"
+        and (fields is None or name in fields or name == cls._unique_identifier)
+    ]
+    linked = {}
+    for name, relationship in cls._relationships.items():
+        if name in tree:
+            linked[name] = _fetch_only(relationship.cls, tree[name])
+        elif fields is None or name in fields:
+            columns.append(name)
+    return q.fetch_only(*columns, **linked)
+
+
+def _fetch_only_queries(cls, preload=None, fields=None):
+    """Return the query arguments needed to preload relationships and project columns
+
+    Preloaded relationship rows are fetched by the same query as the rows which
+    link to them, rather than by a separate table call for each link when each
+    object is hydrated. If fields are given, no other columns are read.
+    """
+    if not preload and fields is None:
+        return []
+    return [_fetch_only(cls, _path_tree(preload or []), fields)]
+
+
+# The operators which a query description may use, and the anvil.tables.query
+# functions they compile to. Equality needs no operator.
+QUERY_OPERATORS = {
+    "eq": None,
+    "ne": q.not_,
+    "gt": q.greater_than,
+    "gte": q.greater_than_or_equal_to,
+    "lt": q.less_than,
+    "lte": q.less_than_or_equal_to,
+    "like": q.like,
+    "ilike": q.ilike,
+    "in": lambda values: q.any_of(*values),
+    "not_in": lambda values: q.none_of(*values),
+    "full_text_match": q.full_text_match,
+}
+
+
+def _query_value(cls, name, value):
+    """Return the value to search for in a column, with model instances replaced
+    by their rows
+
+    Any other value, such as a row or a query operator, is returned unchanged.
+    """
+    if name not in cls._relationships:
+        return value
+    instances = value if isinstance(value, (list, tuple)) else [value]
+    related = cls._relationships[name].cls
+    if not all(i is None or isinstance(i, related) for i in instances):
+        return value
+    class_name = related.__name__
+    uids = [instance.uid for instance in instances if instance is not None]
+    rows = {row["uid"]: row for row in _search_rows(class_name, uids)} if uids else {}
+    for uid in uids:
+        if uid not in rows:
+            raise ValueError(f"No {class_name} object with uid {uid} was found")
+    values = [
+        None if instance is None else rows[instance.uid] for instance in instances
+    ]
+    return values if isinstance(value, (list, tuple)) else values[0]
+
+
+def _compile_query(cls, query, search_args):
+    """Compile a query description into the arguments of a table search
+
+    The description is a dict with a list of [name, operator, value] filters, a
+    list of [name, ascending] orderings and a limit. Only members of the model and
+    the operators in QUERY_OPERATORS are accepted. Filters are combined with any
+    plain search arguments and with each other. Model instances in either are
+    replaced by their rows.
+
+    Returns the positional and the keyword arguments for the search.
+    """
+    members = {"uid"} | set(cls._attributes) | set(cls._relationships)
+    conditions = {}
+    for name, value in search_args.items():
+        conditions.setdefault(name, []).append(_query_value(cls, name, value))
+    for name, operator, value in query.get("filters", []):
+        if name not in members:
+            raise ValueError(f"{cls.__name__} has no member named {name}")
+        if operator not in QUERY_OPERATORS:
+            raise ValueError(f"Unknown query operator '{operator}'")
+        value = _query_value(cls, name, value)
+        if QUERY_OPERATORS[operator] is not None:
+            value = QUERY_OPERATORS[operator](value)
+        conditions.setdefault(name, []).append(value)
+    kwargs = {
+        name: values[0] if len(values) == 1 else q.all_of(*values)
+        for name, values in conditions.items()
+    }
+
+    args = []
+    for name, ascending in query.get("order_by", []):
+        if name != "uid" and name not in cls._attributes:
+            raise ValueError(f"{cls.__name__} has no attribute named {name}")
+        args.append(order_by(name, ascending=bool(ascending)))
+
+    limit = query.get("limit")
+    if limit is not None and (not isinstance(limit, int) or limit < 0):
+        raise ValueError("A query limit must be a whole number")
+    return args, kwargs
+
+
+def _search_arguments(cls, search_definition):
+    """Return the positional and keyword arguments of the table search for a search
+    definition"""
+    return _compile_query(
+        cls, search_definition["query"] or {}, search_definition["search_args"]
+    )
+
+
+def _limited(length, search_definition):
+    """Return the number of results of a search, allowing for the query's limit"""
+    query = search_definition["query"]
+    if query is not None and query.get("limit") is not None:
+        return min(length, query["limit"])
+    return length
 
 
 def _search_rows(class_name, uids):
     """Return the data tables rows for a given list of object instances"""
+    _count("table.search")
     return get_table(class_name).search(uid=q.any_of(*uids))
 
 
-@anvil.server.callable
-def get_object(class_name, module_name, uid, max_depth=None):
-    """Create a model object instance from the relevant data table row"""
-    if security.has_read_permission(class_name, uid):
-        module = import_module(module_name)
-        cls = getattr(module, class_name)
-        instance = cls._from_row(
-            _get_row(class_name, module_name, uid), max_depth=max_depth
-        )
-        if security.has_update_permission(class_name, uid):
+def _get_class(class_name, module_name):
+    """Return the model class for the given class and module names
+
+    The class is imported and its schema compiled on first use only.
+    """
+    schema = _schemas.get(class_name)
+    if schema is None or schema["cls"].__module__ != module_name:
+        cls = model_registry.get((module_name, class_name))
+        if cls is None:
+            cls = getattr(import_module(module_name), class_name)
+        schema = _compile(cls)
+    return schema["cls"]
+
+
+def _count(name, n=1):
+    """Add to a counter, if instrumentation is in use"""
+    recorder = particles.instrumentation
+    if recorder is not None:
+        recorder.count(name, n)
+
+
+def _timed(name):
+    """A decorator to record the time taken by each call of a function, if
+    instrumentation is in use"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            recorder = particles.instrumentation
+            if recorder is None:
+                return function(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                recorder.timing(name, perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class _PermissionMemo:
+    """The security policy decisions made during a single server call"""
+
+    def __init__(self):
+        self.decisions = {}
+        self.depth = 0
+
+
+_memo = threading.local()
+
+
+def _request_scoped(function):
+    """A decorator to memoize security policy decisions for the duration of a call
+
+    Nested calls share the memo of the outermost call. If instrumentation is in use,
+    the time taken by each call is recorded too.
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        memo = getattr(_memo, "current", None)
+        if memo is None:
+            memo = _memo.current = _PermissionMemo()
+        memo.depth += 1
+        recorder = particles.instrumentation
+        if recorder is not None:
+            start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            memo.depth -= 1
+            if memo.depth == 0:
+                _memo.current = None
+            if recorder is not None:
+                recorder.timing(f"call.{function.__name__}", perf_counter() - start)
+
+    return wrapper
+
+
+def _decisions(kind, class_name):
+    """Return the memoized decisions for a kind of permission on a class"""
+    memo = getattr(_memo, "current", None)
+    if memo is None:
+        return {}
+    return memo.decisions.setdefault((kind, class_name), {})
+
+
+@_timed("security")
+def _permitted(kind, class_name, uids):
+    """Return the subset of uids for which the given kind of permission is granted
+
+    The security module's batch function for the kind of permission is used if it
+    has one. Otherwise, its single object function is called for each uid.
+    """
+    decisions = _decisions(kind, class_name)
+    unknown = [uid for uid in uids if uid not in decisions]
+    if unknown:
+        check_many = getattr(security, f"has_{kind}_permission_many", None)
+        if check_many is not None:
+            granted = set(check_many(class_name, unknown))
+        else:
+            check = getattr(security, f"has_{kind}_permission")
+            granted = {uid for uid in unknown if check(class_name, uid)}
+        decisions.update({uid: uid in granted for uid in unknown})
+    return {uid for uid in uids if decisions[uid]}
+
+
+@_timed("security")
+def _class_permitted(kind, class_name):
+    """Return whether a kind of permission on a whole class is granted"""
+    decisions = _decisions(kind, class_name)
+    if None not in decisions:
+        decisions[None] = getattr(security, f"has_{kind}_permission")(class_name)
+    return decisions[None]
+
+
+@_timed("capabilities")
+def _add_capabilities(instances, class_name, uids):
+    """Attach update and delete capabilities to a list of instances
+
+    The permission checks are made once for the whole list rather than once per
+    instance.
+    """
+    updatable = _permitted("update", class_name, uids)
+    deletable = _permitted("delete", class_name, uids)
+    for instance, uid in zip(instances, uids):
+        if uid in updatable:
             instance.update_capability = Capability([class_name, uid])
-        if security.has_delete_permission(class_name, uid):
+        if uid in deletable:
             instance.delete_capability = Capability([class_name, uid])
-        return instance
+    return instances
+
+
+@_timed("capabilities")
+def _page_capabilities(instances, class_name, uids):
+    """Return a single update and a single delete capability for a page of instances
+
+    Each capability has the scope [class_name, [uid, ...]] and covers every
+    instance on the page for which that permission is granted. The uids covered are
+    returned alongside each capability so that the client can attach them.
+    """
+    updatable = _permitted("update", class_name, uids)
+    deletable = _permitted("delete", class_name, uids)
+    capabilities = {}
+    for kind, permitted in (("update", updatable), ("delete", deletable)):
+        covered = [
+            instance.uid for instance, uid in zip(instances, uids) if uid in permitted
+        ]
+        if covered:
+            capabilities[kind] = (Capability([class_name, covered]), covered)
+    return capabilities
+
+
+def _require_capability(capability, class_name, uid):
+    """Raise an error unless a capability covers the given object
+
+    The capability may cover a single object, with the scope [class_name, uid], or a
+    page of objects, with the scope [class_name, [uid, ...]].
+    """
+    scope = capability.scope if capability is not None else None
+    if scope is not None and len(scope) == 2 and isinstance(scope[1], list):
+        Capability.require(capability, [class_name, scope[1]])
+        if uid not in scope[1]:
+            raise ValueError("You do not have permission to change this object")
+    else:
+        Capability.require(capability, [class_name, uid])
+
+
+def _load_row(cls, row):
+    """Read the columns of a row which hydrating it as cls reads, so that reading
+    them again needs no table call
+
+    Other columns, such as large media columns, are left unread.
+    """
+    for name in ["uid"] + list(cls._attributes) + list(cls._relationships):
+        row[name]
+
+
+def _prefetch(cls, rows, max_depth=None, fields=None, preload=None):
+    """Load the rows linked from a list of rows concurrently, using hydration_executor
+
+    The linked rows are loaded one level of relationships at a time, down to
+    max_depth, with all the rows of a level loaded together. Each row is loaded
+    once, so a cycle of links ends the walk. The rows are hydrated afterwards,
+    serially and in their original order, as they would be without prefetching.
+
+    Only the relationships in fields are followed from the rows themselves, as only
+    those are hydrated. Rows preloaded by the search arrived with it and are not
+    loaded again, though the walk continues through them.
+    """
+    seen = set()
+    level = [(cls, row, _path_tree(preload or [])) for row in rows]
+    depth = 0
+    while level and (max_depth is None or depth < max_depth):
+        linked = []
+        for row_cls, row, tree in level:
+            for name, relationship in row_cls._relationships.items():
+                if depth == 0 and fields is not None and name not in fields:
+                    continue
+                value = row[name]
+                members = value if relationship.with_many else [value]
+                for member in members or []:
+                    if member is not None and member.get_id() not in seen:
+                        seen.add(member.get_id())
+                        linked.append((relationship.cls, member, tree.get(name)))
+        unloaded = [(row_cls, row) for row_cls, row, tree in linked if tree is None]
+        list(
+            hydration_executor.map(
+                _load_row,
+                [row_cls for row_cls, _ in unloaded],
+                [row for _, row in unloaded],
+            )
+        )
+        level = [(row_cls, row, tree or {}) for row_cls, row, tree in linked]
+        depth += 1
+
+
+@_timed("hydrate")
+def _hydrate_rows(
+    cls, rows, max_depth=None, fields=None, lazy_relationships=False, preload=None
+):
+    """Create model object instances, without capabilities, from a list of rows
+
+    Rows for which the user has no read permission are omitted. Related objects
+    referred to by more than one row are hydrated only once. Returns the instances
+    and the unique identifiers of their rows. preload names the relationships whose
+    rows were fetched with the rows themselves.
+    """
+    class_name = cls.__name__
+    rows_by_uid = {row[cls._unique_identifier]: row for row in rows}
+    readable = _permitted("read", class_name, rows_by_uid)
+    uids = [uid for uid in rows_by_uid if uid in readable]
+    identity_map = {}
+    cacheable = object_cache is not None and fields is None and not lazy_relationships
+    if hydration_executor is not None:
+        _prefetch(cls, [rows_by_uid[uid] for uid in uids], max_depth, fields, preload)
+    instances = []
+    for uid in uids:
+        instance = None
+        if cacheable:
+            instance = object_cache.get(class_name, uid, max_depth)
+        if instance is None:
+            instance = cls._from_row(
+                rows_by_uid[uid],
+                max_depth=max_depth,
+                identity_map=identity_map,
+                fields=fields,
+                lazy_relationships=lazy_relationships,
+            )
+            if cacheable:
+                object_cache.put(class_name, uid, max_depth, instance)
+        instances.append(instance)
+    if particles.instrumentation is not None:
+        for _, depth in identity_map.values():
+            _count(f"rows.hydrated.depth_{depth}")
+    return instances, uids
+
+
+def _objects_from_rows(
+    cls, rows, max_depth=None, fields=None, lazy_relationships=False
+):
+    """Create model object instances, with capabilities, from a list of rows"""
+    instances, uids = _hydrate_rows(cls, rows, max_depth, fields, lazy_relationships)
+    return _add_capabilities(instances, cls.__name__, uids)
+
+
+def _invalidate(class_name, uids):
+    """Remove changed objects, and any which embed them, from the object cache"""
+    if object_cache is not None:
+        for uid in uids:
+            object_cache.invalidate(class_name, uid)
+
+
+@anvil.server.callable
+@_request_scoped
+def get_object(
+    class_name,
+    module_name,
+    uid,
+    max_depth=None,
+    preload=None,
+    fields=None,
+    lazy_relationships=False,
+):
+    """Create a model object instance from the relevant data table row
+
+    If an object cache is in use, a cached copy is returned without reading the
+    table at all.
+    """
+    if _permitted("read", class_name, [uid]):
+        cacheable = (
+            object_cache is not None and fields is None and not lazy_relationships
+        )
+        instance = None
+        if cacheable:
+            instance = object_cache.get(class_name, uid, max_depth)
+        if instance is None:
+            cls = _get_class(class_name, module_name)
+            instance = cls._from_row(
+                _get_row(class_name, module_name, uid, preload, fields),
+                max_depth=max_depth,
+                identity_map={},
+                fields=fields,
+                lazy_relationships=lazy_relationships,
+            )
+            if cacheable and instance is not None:
+                object_cache.put(class_name, uid, max_depth, instance)
+        return _add_capabilities([instance], class_name, [uid])[0]
+
+
+@anvil.server.callable
+@_request_scoped
+def get_objects(
+    class_name,
+    module_name,
+    uids,
+    max_depth=None,
+    fields=None,
+    lazy_relationships=False,
+    row_ids=None,
+):
+    """Create model object instances for a list of uids with a single table search
+
+    Relationship placeholders, whose uids were never read, are loaded instead by
+    the row ids given in row_ids.
+    """
+    cls = _get_class(class_name, module_name)
+    table = get_table(class_name)
+    if row_ids:
+        _count("table.get", len(row_ids))
+        rows = [table.get_by_id(row_id) for row_id in row_ids]
+        rows = [row for row in rows if row is not None]
+    else:
+        _count("table.search")
+        rows = table.search(
+            *_fetch_only_queries(cls, fields=fields), uid=q.any_of(*uids)
+        )
+    return _objects_from_rows(cls, rows, max_depth, fields, lazy_relationships)
 
 
 # @anvil.server.callable
@@ -136,126 +764,611 @@ def get_object(class_name, module_name, uid, max_depth=None):
 #     return [cls._from_row(row) for row in rows[start:end]], is_last_page
 
 
+def _bounded_page(rows, page_length):
+    """Return a page of rows and whether it is the last one
+
+    One row beyond the page is read to detect the last page without counting the
+    search results.
+    """
+    page = list(islice(rows, page_length + 1))
+    return page[:page_length], len(page) <= page_length
+
+
+def _keyset_page(table, uid_column, search_args, after, page_length, queries=()):
+    """Return the page of rows following the uid given by 'after'
+
+    Rows are ordered by their unique identifier so that the next page can be found
+    with a bounded query rather than by skipping over all the preceding rows.
+    """
+    search_args = search_args.copy()
+    if after is not None:
+        bound = q.greater_than(after)
+        if uid_column in search_args:
+            bound = q.all_of(search_args[uid_column], bound)
+        search_args[uid_column] = bound
+    _count("table.search")
+    rows = table.search(order_by(uid_column), *queries, **search_args)
+    page, is_last_page = _bounded_page(rows, page_length)
+    if page:
+        after = page[-1][uid_column]
+    return page, is_last_page, after
+
+
 @anvil.server.callable
-def fetch_objects(class_name, module_name, rows_id, page, page_length, max_depth=None):
-    """Return a list of object instances from a cached data tables search"""
-    search_definition = anvil.server.session.get(rows_id, None).copy()
-    if search_definition is not None:
-        class_name = search_definition.pop("class_name")
-        rows = get_table(class_name).search(**search_definition)
-    else:
-        rows = []
+@_request_scoped
+def fetch_objects(
+    class_name, module_name, rows_id, page, page_length, max_depth=None, after=None
+):
+    """Return a list of object instances from a cached data tables search
+
+    For searches made in cursor mode, 'after' is the unique identifier of the last
+    row of the previous page and 'page' is only used to apply a query's limit.
+
+    Returns the page of instances, whether it is the last page, the cursor for the
+    next page and, for searches made with page_capabilities, the capabilities
+    covering the whole page.
+
+    For searches made in compact mode, the page of instances is encoded by
+    _encode_page and always has page capabilities, as the encoding does not carry
+    capabilities for individual objects.
 
+    The class is taken from the stored search rather than from the arguments, so
+    that rows are only ever hydrated as the class they were searched for.
+    """
+    search_definition = _load_search(rows_id)
+    if search_definition is None:
+        return [], True, after, None
+
+    cls = _get_class(search_definition["class_name"], search_definition["module_name"])
+    table = get_table(cls.__name__)
+    fields = search_definition["fields"]
+    queries = _fetch_only_queries(cls, search_definition["preload"], fields)
+    args, kwargs = _search_arguments(cls, search_definition)
+    # A query's limit may cut the page short and make it the last
     start = page * page_length
-    end = (page + 1) * page_length
-    is_last_page = end >= len(rows)
-    if is_last_page:
-        del anvil.server.session[rows_id]
-
-    module = import_module(module_name)
-    cls = getattr(module, class_name)
-    results = (
-        [
-            get_object(class_name, module_name, row[cls._unique_identifier], max_depth)
-            for row in rows[start:end]
-        ],
-        is_last_page,
+    end = _limited(start + page_length + 1, search_definition)
+    size = max(min(end - start, page_length), 0)
+    if search_definition["cursor"]:
+        rows, is_last_page, after = _keyset_page(
+            table, cls._unique_identifier, kwargs, after, size, queries
+        )
+    else:
+        _count("table.search")
+        rows = table.search(*queries, *args, **kwargs)
+        rows, is_last_page = _bounded_page(rows[start:end], size)
+    if end - start <= page_length:
+        is_last_page = True
+
+    objects, uids = _hydrate_rows(
+        cls,
+        rows,
+        max_depth,
+        fields,
+        search_definition["lazy_relationships"],
+        search_definition["preload"],
     )
+    _count("objects.returned", len(objects))
+    capabilities = None
+    compact = search_definition["compact"]
+    if search_definition["page_capabilities"] or compact:
+        capabilities = _page_capabilities(objects, cls.__name__, uids)
+    else:
+        _add_capabilities(objects, cls.__name__, uids)
+    if compact:
+        objects = _encode_page(objects)
+    results = (objects, is_last_page, after, capabilities)
     return results
 
 
+@anvil.server.callable
+@_request_scoped
+def count_objects(rows_id):
+    """Return the number of rows matched by a cached data tables search"""
+    search_definition = _load_search(rows_id)
+    if search_definition is None:
+        raise ValueError("The search results are no longer available")
+    cls = _get_class(search_definition["class_name"], search_definition["module_name"])
+    args, kwargs = _search_arguments(cls, search_definition)
+    table = get_table(search_definition["class_name"])
+    _count("table.search")
+    return _limited(len(table.search(*args, **kwargs)), search_definition)
+
+
 @anvil.server.callable
 @caching_query
 def basic_search(class_name, **search_args):
     """Perform a data tables search against the relevant table for the given class"""
+    _count("table.search")
     return get_table(class_name).search(**search_args)
 
 
-@anvil.server.callable
-def save_object(instance):
-    """Persist an instance to the database by adding or updating a row"""
-    class_name = type(instance).__name__
-    table = get_table(class_name)
+def _saved_members(instance):
+    """Return the names of the members of an instance which need to be written
+
+    For an instance fetched from the database, only those members changed since it
+    was fetched are included. Deferred members were never fetched and so cannot
+    have been changed.
+    """
+    changed = instance._changed_members()
+    return [
+        name
+        for name in list(instance._attributes) + list(instance._relationships)
+        if name not in instance._deferred and (changed is None or name in changed)
+    ]
+
+
+def _related_key(class_name, member):
+    """Return the key of a related object's row in the result of _related_rows
+
+    A relationship placeholder, whose uid was never read, is keyed by its row id.
+    """
+    if "uid" in member._deferred:
+        return (class_name, "row", member._row_id)
+    return (class_name, member.uid)
+
+
+def _related_rows(instances):
+    """Return the rows for the related objects of a list of instances
+
+    The rows are keyed by _related_key and are fetched with one search per related
+    class rather than one table call per relationship. Relationship placeholders
+    are fetched by row id. Relationships which have not changed are not resolved
+    at all.
+    """
+    uids = {}
+    row_ids = {}
+    for instance in instances:
+        saved = _saved_members(instance)
+        for name, relationship in instance._relationships.items():
+            if name not in saved:
+                continue
+            value = getattr(instance, name)
+            members = value if relationship.with_many else [value]
+            class_name = relationship.cls.__name__
+            for member in members:
+                if member is None:
+                    continue
+                key = _related_key(class_name, member)
+                if len(key) == 3:
+                    row_ids.setdefault(class_name, set()).add(key[2])
+                else:
+                    uids.setdefault(class_name, set()).add(key[1])
+
+    rows = {}
+    for class_name, class_uids in uids.items():
+        if class_uids:
+            for row in _search_rows(class_name, list(class_uids)):
+                rows[(class_name, row["uid"])] = row
+    for class_name, class_row_ids in row_ids.items():
+        table = get_table(class_name)
+        for row_id in class_row_ids:
+            _count("table.get")
+            row = table.get_by_id(row_id)
+            if row is not None:
+                rows[(class_name, "row", row_id)] = row
+    return rows
 
+
+def _members(instance, related_rows):
+    """Return the column values to be written for an instance
+
+    Returns the values of the changed columns and, separately, the rows linked by
+    changed single relationships, which are needed to maintain cross references.
+    """
+    saved = _saved_members(instance)
     attributes = {
         name: getattr(instance, name)
         for name, attribute in instance._attributes.items()
+        if name in saved
     }
     single_relationships = {
-        name: _get_row(
-            relationship.cls.__name__,
-            relationship.cls.__module__,
-            getattr(instance, name).uid,
+        name: (
+            related_rows.get(
+                _related_key(relationship.cls.__name__, getattr(instance, name))
+            )
+            if getattr(instance, name) is not None
+            else None
         )
         for name, relationship in instance._relationships.items()
-        if not relationship.with_many and getattr(instance, name) is not None
+        if not relationship.with_many and name in saved
     }
     multi_relationships = {
-        name: list(
-            _search_rows(
-                relationship.cls.__name__,
-                [
-                    member.uid
-                    for member in getattr(instance, name)
-                    if member is not None
-                ],
-            )
-        )
+        name: [
+            related_rows[_related_key(relationship.cls.__name__, member)]
+            for member in getattr(instance, name)
+            if member is not None
+            and _related_key(relationship.cls.__name__, member) in related_rows
+        ]
         for name, relationship in instance._relationships.items()
-        if relationship.with_many
+        if relationship.with_many and name in saved
     }
 
     members = {**attributes, **single_relationships, **multi_relationships}
-    cross_references = [
-        {"name": name, "relationship": relationship}
-        for name, relationship in instance._relationships.items()
-        if relationship.cross_reference is not None
-    ]
+    if instance.version_column is not None and (members or instance.uid is None):
+        members[instance.version_column] = datetime.now(timezone.utc)
+    return members, single_relationships
 
-    has_permission = False
+
+def _check_save_permission(instance):
+    """Raise an error unless the user may save the given instance"""
+    class_name = type(instance).__name__
     if instance.uid is not None:
         if getattr(instance, "update_capability") is not None:
-            Capability.require(instance.update_capability, [class_name, instance.uid])
-            has_permission = True
-            row = table.get(uid=instance.uid)
-            row.update(**members)
+            _require_capability(instance.update_capability, class_name, instance.uid)
         else:
             raise ValueError("You do not have permission to update this object")
+    elif not _class_permitted("create", class_name):
+        raise ValueError("You do not have permission to save this object")
+
+
+class _CrossReferences:
+    """Collects the changes to cross references made by a save
+
+    Only the 'many' side of a cross reference is maintained. Each parent row there
+    is read and written at most once for the whole save, however many of its
+    children were linked to or unlinked from it, and is not written at all if its
+    links are already correct.
+    """
+
+    def __init__(self):
+        self._parents = {}
+
+    def _parent(self, relationship, parent_row):
+        key = (parent_row.get_id(), relationship.cross_reference)
+        if key not in self._parents:
+            self._parents[key] = (parent_row, relationship, {}, set())
+        return self._parents[key]
+
+    def relink(self, instance, row, single_relationships):
+        """Record the links to change for a row which is about to be updated
+
+        The row's current links are read as its old parents, so this must be called
+        before the row is updated, or after it is added.
+        """
+        for name, relationship in instance._relationships.items():
+            if (
+                relationship.cross_reference is None
+                or relationship.with_many
+                or name not in single_relationships
+            ):
+                continue
+            old_parent = row[name]
+            new_parent = single_relationships[name]
+            if old_parent is not None and (
+                new_parent is None or old_parent.get_id() != new_parent.get_id()
+            ):
+                self._parent(relationship, old_parent)[3].add(row.get_id())
+            if new_parent is not None:
+                self._parent(relationship, new_parent)[2][row.get_id()] = row
+
+    def apply(self):
+        """Write the changed links to each parent row"""
+        for parent_row, relationship, added, removed in self._parents.values():
+            column_name = relationship.cross_reference
+            links = list(parent_row[column_name] or [])
+            linked = {link.get_id() for link in links}
+            kept = [link for link in links if link.get_id() not in removed]
+            new = [row for row_id, row in added.items() if row_id not in linked]
+            if new or len(kept) < len(links):
+                changes = {column_name: kept + new}
+                # The parent has changed too, so that a delta sync of its class
+                # sees children moving in or out
+                if relationship.cls.version_column is not None:
+                    changes[relationship.cls.version_column] = datetime.now(
+                        timezone.utc
+                    )
+                parent_row.update(**changes)
+                _invalidate(relationship.cls.__name__, [parent_row["uid"]])
+
+
+@anvil.server.callable
+@_request_scoped
+def save_object(instance):
+    """Persist an instance to the database by adding or updating a row"""
+    class_name = type(instance).__name__
+    table = get_table(class_name)
+    _check_save_permission(instance)
+    members, single_relationships = _members(instance, _related_rows([instance]))
+
+    cross_references = _CrossReferences()
+    if instance.uid is not None:
+        if not members:
+            return instance._mark_clean()
+        _count("table.get")
+        row = table.get(uid=instance.uid)
+        cross_references.relink(instance, row, single_relationships)
+        row.update(**members)
     else:
-        if security.has_create_permission(class_name):
-            has_permission = True
-            uid = uuid4().hex
-            instance = copy(instance)
-            instance.uid = uid
-            row = table.add_row(uid=uid, **members)
-            if security.has_update_permission(class_name, uid):
-                instance.update_capability = Capability([class_name, uid])
-            if security.has_delete_permission(class_name, uid):
-                instance.delete_capability = Capability([class_name, uid])
-        else:
-            raise ValueError("You do not have permission to save this object")
+        uid = uuid4().hex
+        instance = copy(instance)
+        instance.uid = uid
+        _count("table.add_row")
+        row = table.add_row(uid=uid, **members)
+        cross_references.relink(instance, row, single_relationships)
+        _add_capabilities([instance], class_name, [uid])
 
-    if has_permission:
-        # Very simple cross reference update
-        for xref in cross_references:
+    cross_references.apply()
+    _invalidate(class_name, [instance.uid])
+    return instance._mark_clean()
 
-            # We only update the 'many' side of a cross reference
-            if not xref["relationship"].with_many:
-                xref_row = single_relationships[xref["name"]]
-                column_name = xref["relationship"].cross_reference
 
-                # We simply ensure that the 'one' side is included in the 'many' side.
-                # We don't cleanup any possibly redundant entries on the 'many' side.
-                if row not in xref_row[column_name]:
-                    xref_row[column_name] += [row]
+@anvil.server.callable
+@_request_scoped
+def save_objects(class_name, instances):
+    """Persist a list of instances of the same class in bulk
 
-    return instance
+    Related rows for the whole list are found with one search per related class,
+    existing rows are updated in a single batch and new rows are added together.
+    """
+    for instance in instances:
+        if type(instance).__name__ != class_name:
+            raise ValueError(
+                f"save_objects received an instance which is not a {class_name}"
+            )
+        _check_save_permission(instance)
+
+    table = get_table(class_name)
+    related_rows = _related_rows(instances)
+    members = [_members(instance, related_rows) for instance in instances]
+
+    existing_uids = [
+        instance.uid
+        for instance, (instance_members, _) in zip(instances, members)
+        if instance.uid is not None and instance_members
+    ]
+    rows = {}
+    if existing_uids:
+        rows = {row["uid"]: row for row in _search_rows(class_name, existing_uids)}
+
+    results = list(instances)
+    new_positions = [i for i, instance in enumerate(instances) if instance.uid is None]
+    cross_references = _CrossReferences()
+    with anvil.tables.batch_update:
+        for instance, (instance_members, single_relationships) in zip(
+            instances, members
+        ):
+            if instance.uid is not None and instance_members:
+                row = rows[instance.uid]
+                cross_references.relink(instance, row, single_relationships)
+                row.update(**instance_members)
+
+    if new_positions:
+        new_uids = [uuid4().hex for _ in new_positions]
+        _count("table.add_rows")
+        new_rows = table.add_rows(
+            [
+                dict(uid=uid, **members[position][0])
+                for position, uid in zip(new_positions, new_uids)
+            ]
+        )
+        new_instances = []
+        for position, uid, row in zip(new_positions, new_uids, new_rows):
+            instance = copy(instances[position])
+            instance.uid = uid
+            results[position] = instance
+            new_instances.append(instance)
+            cross_references.relink(instance, row, members[position][1])
+        _add_capabilities(new_instances, class_name, new_uids)
+
+    with anvil.tables.batch_update:
+        cross_references.apply()
+    for instance in results:
+        instance._mark_clean()
+    _invalidate(class_name, [instance.uid for instance in instances if instance.uid])
+    return results
+
+
+def _record_deletions(cls, uids):
+    """Add tombstones for deleted rows of a class which records its changes"""
+    if cls.version_column is not None and uids:
+        deleted_at = datetime.now(timezone.utc)
+        _count("table.add_rows")
+        getattr(app_tables, TOMBSTONE_TABLE).add_rows(
+            [
+                {"class_name": cls.__name__, "uid": uid, "deleted_at": deleted_at}
+                for uid in uids
+            ]
+        )
 
 
 @anvil.server.callable
+@_request_scoped
 def delete_object(instance):
     """Delete the data tables row for the given model instance"""
     class_name = type(instance).__name__
-    Capability.require(instance.delete_capability, [class_name, instance.uid])
+    _require_capability(instance.delete_capability, class_name, instance.uid)
     table = get_table(type(instance).__name__)
+    _count("table.get")
     table.get(uid=instance.uid).delete()
+    _record_deletions(type(instance), [instance.uid])
+    _invalidate(class_name, [instance.uid])
+
+
+@anvil.server.callable
+@_request_scoped
+def delete_objects(class_name, instances):
+    """Delete the data tables rows for a list of model instances in bulk
+
+    Every instance's capability is verified before any row is deleted.
+    """
+    for instance in instances:
+        if type(instance).__name__ != class_name:
+            raise ValueError(
+                f"delete_objects received an instance which is not a {class_name}"
+            )
+        _require_capability(instance.delete_capability, class_name, instance.uid)
+    uids = [instance.uid for instance in instances]
+    if uids:
+        _search_rows(class_name, uids).delete_all_rows()
+        _record_deletions(type(instances[0]), uids)
+        _invalidate(class_name, uids)
+
+
+@anvil.server.callable
+@_request_scoped
+def delete_where(class_name, module_name, **search_args):
+    """Delete the data tables rows matching a search without creating objects
+
+    Only the uid column of the matching rows is fetched. Nothing is deleted unless
+    the user has bulk delete permission for the class and delete permission for
+    every matching object.
+    """
+    if not search_args:
+        raise ValueError("delete_where requires at least one search argument")
+    if not _class_permitted("bulk_delete", class_name):
+        raise ValueError("You do not have permission to delete these objects")
+    cls = _get_class(class_name, module_name)
+    _, search_args = _compile_query(cls, {}, search_args)
+    _count("table.search")
+    rows = get_table(class_name).search(q.fetch_only("uid"), **search_args)
+    uids = [row["uid"] for row in rows]
+    if len(_permitted("delete", class_name, uids)) < len(set(uids)):
+        raise ValueError("You do not have permission to delete these objects")
+    _record_deletions(cls, uids)
+    rows.delete_all_rows()
+    if object_cache is not None:
+        object_cache.invalidate_class(class_name)
+
+
+# The functions which aggregate_objects can apply to the non-empty values of a column
+AGGREGATE_FUNCTIONS = {
+    "sum": sum,
+    "min": min,
+    "max": max,
+    "avg": lambda values: sum(values) / len(values),
+}
+
+
+def _group_value(value):
+    """Return the value by which to group a row, with linked rows given by uid"""
+    if isinstance(value, list):
+        return tuple(member["uid"] for member in value)
+    if hasattr(value, "get_id"):
+        return value["uid"]
+    return value
+
+
+@anvil.server.callable
+@_request_scoped
+def aggregate_objects(
+    class_name, module_name, aggregates, group_by=None, query=None, **search_args
+):
+    """Aggregate the rows matching a search without creating any objects
+
+    aggregates is a list of [function, column] pairs, where function is one of the
+    keys of AGGREGATE_FUNCTIONS. Only the columns needed are fetched.
+
+    Without group_by, returns a dict with the count of rows and an entry, e.g.
+    'sum_price', for each aggregate. With a list of group_by columns, returns a list
+    of such dicts, one for each group, which also hold the group's column values.
+    Linked rows in those columns are given by uid.
+    """
+    if not _class_permitted("search", class_name):
+        raise ValueError("You do not have permission to search these objects")
+    cls = _get_class(class_name, module_name)
+    search_definition = {"search_args": search_args, "query": query}
+    args, kwargs = _search_arguments(cls, search_definition)
+    table = get_table(class_name)
+
+    group_by = group_by or []
+    columns = []
+    for function, column in aggregates:
+        if function not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Unknown aggregate function '{function}'")
+        if column not in cls._attributes:
+            raise ValueError(f"{cls.__name__} has no attribute named {column}")
+        if column not in columns:
+            columns.append(column)
+    for name in group_by:
+        if name not in cls._attributes and name not in cls._relationships:
+            raise ValueError(f"{cls.__name__} has no member named {name}")
+
+    _count("table.search")
+    if not columns and not group_by:
+        return {
+            "count": _limited(len(table.search(*args, **kwargs)), search_definition)
+        }
+
+    linked = {
+        name: q.fetch_only("uid") for name in group_by if name in cls._relationships
+    }
+    fetched = [name for name in set(columns + group_by) if name not in linked]
+    rows = table.search(q.fetch_only(*fetched, **linked), *args, **kwargs)
+    if query is not None and query.get("limit") is not None:
+        rows = islice(rows, query["limit"])
+
+    # Without group_by, every row is in the one group, which exists even if empty
+    counts = {}
+    values = {}
+    if not group_by:
+        counts[()] = 0
+        values[()] = {column: [] for column in columns}
+    for row in rows:
+        key = tuple(_group_value(row[name]) for name in group_by)
+        if key not in counts:
+            counts[key] = 0
+            values[key] = {column: [] for column in columns}
+        counts[key] += 1
+        for column in columns:
+            if row[column] is not None:
+                values[key][column].append(row[column])
+
+    results = []
+    for key, count in counts.items():
+        result = dict(zip(group_by, key))
+        result["count"] = count
+        for function, column in aggregates:
+            present = values[key][column]
+            result[f"{function}_{column}"] = (
+                AGGREGATE_FUNCTIONS[function](present) if present else None
+            )
+        results.append(result)
+    return results if group_by else results[0]
+
+
+@anvil.server.callable
+@_request_scoped
+def sync_objects(class_name, module_name, since, max_depth=None, **search_args):
+    """Return the changes to the results of a search since a previous sync
+
+    Returns the objects matching the search which were added or changed since the
+    given token, the uids of objects which were deleted or no longer match and a
+    token for the next sync. The token allows SYNC_OVERLAP for saves still in
+    flight, so the next sync may return some objects again. If since is None, only
+    a token is returned: the first snapshot should come from a paged search made
+    after the token was taken. The class must name the column in which save_object
+    records its changes. Only the uids the user may read are returned as removed, so
+    the read permission check may be asked about deleted objects.
+    """
+    if not _class_permitted("search", class_name):
+        raise ValueError("You do not have permission to search these objects")
+    cls = _get_class(class_name, module_name)
+    column = cls.version_column
+    if column is None:
+        raise ValueError(f"{class_name} does not define a version_column")
+
+    token = datetime.now(timezone.utc) - SYNC_OVERLAP
+    if since is None:
+        return [], [], token
+
+    _, search_args = _compile_query(cls, {}, search_args)
+    table = get_table(class_name)
+
+    changed_since = q.greater_than_or_equal_to(since)
+    _count("table.search")
+    changed_uids = {
+        row["uid"]
+        for row in table.search(q.fetch_only("uid"), **{column: changed_since})
+    }
+    if column in search_args:
+        changed_since = q.all_of(search_args[column], changed_since)
+    _count("table.search")
+    rows = list(table.search(**{**search_args, column: changed_since}))
+    removed = changed_uids - {row["uid"] for row in rows}
+    _count("table.search")
+    tombstones = getattr(app_tables, TOMBSTONE_TABLE).search(
+        class_name=class_name, deleted_at=q.greater_than_or_equal_to(since)
+    )
+    removed.update(row["uid"] for row in tombstones)
+    removed = _permitted("read", class_name, removed)
+    return _objects_from_rows(cls, rows, max_depth), sorted(removed), token
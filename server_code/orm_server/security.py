@@ -43,5 +43,25 @@ def has_delete_permission(class_name, uid):
     return True
 
 
+def has_bulk_delete_permission(class_name):
+    return True
+
+
 def has_search_permission(class_name):
     return True
+
+
+# Batch versions of the object permission checks, used for pages of search results
+# and bulk operations. Each returns the subset of the given uids for which
+# permission is granted. Replace these with a single query against your policy
+# tables rather than one query per uid.
+def has_read_permission_many(class_name, uids):
+    return {uid for uid in uids if has_read_permission(class_name, uid)}
+
+
+def has_update_permission_many(class_name, uids):
+    return {uid for uid in uids if has_update_permission(class_name, uid)}
+
+
+def has_delete_permission_many(class_name, uids):
+    return {uid for uid in uids if has_delete_permission(class_name, uid)}
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in ["tests/stubs", "client_code", "server_code"]:
+    sys.path.insert(0, os.path.join(root, path))
+
+
+@pytest.fixture
+def tables(monkeypatch):
+    """Return a function which adds an in-memory table, with a uid column, to
+    app_tables
+
+    Each test starts with no compiled schemas and an empty server session.
+    """
+    import anvil.server
+    from anvil.tables import Table, app_tables
+    from orm_server import persistence
+
+    monkeypatch.setattr(persistence, "_schemas", {})
+    monkeypatch.setattr(anvil.server, "session", {})
+
+    def add_table(table_name, **columns):
+        table = Table({"uid": "string", **columns})
+        monkeypatch.setattr(app_tables, table_name, table, raising=False)
+        return table
+
+    return add_table
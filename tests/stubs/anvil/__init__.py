@@ -0,0 +1,5 @@
+"""A stand-in for the parts of the Anvil runtime used by the ORM
+
+It is just enough to import and exercise the client and server modules outside an
+Anvil app, in the tests and the benchmarks.
+"""
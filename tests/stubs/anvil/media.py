@@ -0,0 +1,13 @@
+class BlobMedia:
+    def __init__(self, content_type, content, name=None):
+        self.content_type = content_type
+        self.name = name
+        self._content = content
+
+    def get_bytes(self):
+        return self._content
+
+
+def from_file(file_name, mime_type=None, name=None):
+    with open(file_name, "rb") as media_file:
+        return BlobMedia(mime_type, media_file.read(), name=name)
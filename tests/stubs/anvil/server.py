@@ -0,0 +1,49 @@
+class _Context:
+    type = "server"
+
+
+context = _Context()
+session = {}
+
+
+class PermissionDenied(Exception):
+    pass
+
+
+class Capability:
+    def __init__(self, scope):
+        self.scope = list(scope)
+
+    @staticmethod
+    def require(capability, scope_prefix=None):
+        """Raise PermissionDenied unless the capability's scope starts with the
+        given prefix"""
+        if not isinstance(capability, Capability):
+            raise PermissionDenied("A capability is required")
+        if scope_prefix is not None:
+            if capability.scope[: len(scope_prefix)] != list(scope_prefix):
+                raise PermissionDenied("The capability does not cover this scope")
+
+
+def portable_class(cls, name=None):
+    return cls
+
+
+def serializable_type(cls, name=None):
+    return cls
+
+
+def callable(function):
+    return function
+
+
+def background_task(function):
+    return function
+
+
+def call(name, *args, **kwargs):
+    raise NotImplementedError("There is no server to call outside an Anvil app")
+
+
+def launch_background_task(name, *args, **kwargs):
+    raise NotImplementedError("There are no background tasks outside an Anvil app")
@@ -0,0 +1,147 @@
+"""In-memory data tables, with just enough of the Anvil API for the ORM"""
+
+from itertools import count
+
+from . import query
+
+
+class _AppTables:
+    """Tables are set as attributes by the code which uses them"""
+
+    def __getattr__(self, name):
+        raise AttributeError(f"No table named {name}")
+
+
+app_tables = _AppTables()
+
+
+class _OrderBy:
+    def __init__(self, column_name, ascending=True):
+        self.column_name = column_name
+        self.ascending = ascending
+
+
+def order_by(column_name, ascending=True):
+    return _OrderBy(column_name, ascending)
+
+
+class _BatchUpdate:
+    """Used as 'with anvil.tables.batch_update:', as in Anvil"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+batch_update = _BatchUpdate()
+
+
+class Row:
+    _ids = count()
+
+    def __init__(self, table, columns):
+        self._table = table
+        self._columns = columns
+        self._id = f"[{table.table_id},{next(self._ids)}]"
+
+    def get_id(self):
+        return self._id
+
+    def keys(self):
+        return self._columns.keys()
+
+    def __getitem__(self, column_name):
+        return self._columns[column_name]
+
+    def __setitem__(self, column_name, value):
+        self.update(**{column_name: value})
+
+    def update(self, **columns):
+        unknown = set(columns) - set(self._table.columns)
+        if unknown:
+            raise KeyError(f"No column named {', '.join(sorted(unknown))}")
+        self._table.writes += 1
+        self._columns.update(columns)
+
+    def delete(self):
+        self._table.rows.remove(self)
+
+    def __eq__(self, other):
+        return isinstance(other, Row) and other._id == self._id
+
+    def __hash__(self):
+        return hash(self._id)
+
+    def __repr__(self):
+        return f"<Row {self._id} {self._columns}>"
+
+
+class SearchResults(list):
+    def delete_all_rows(self):
+        for row in list(self):
+            row.delete()
+
+
+class Table:
+    """A table whose columns are given as a dict of names and types"""
+
+    _ids = count(1)
+
+    def __init__(self, columns):
+        self.table_id = next(self._ids)
+        self.columns = dict(columns)
+        self.rows = []
+        self.writes = 0
+
+    def list_columns(self):
+        return [{"name": name, "type": kind} for name, kind in self.columns.items()]
+
+    def add_row(self, **columns):
+        unknown = set(columns) - set(self.columns)
+        if unknown:
+            raise KeyError(f"No column named {', '.join(sorted(unknown))}")
+        values = {name: None for name in self.columns}
+        values.update(columns)
+        row = Row(self, values)
+        self.rows.append(row)
+        self.writes += 1
+        return row
+
+    def add_rows(self, rows):
+        return [self.add_row(**columns) for columns in rows]
+
+    def get_by_id(self, row_id, *args):
+        for row in self.rows:
+            if row.get_id() == row_id:
+                return row
+        return None
+
+    def search(self, *args, **conditions):
+        orderings = [arg for arg in args if isinstance(arg, _OrderBy)]
+        filters = [arg for arg in args if isinstance(arg, query.Query)]
+        rows = [
+            row
+            for row in self.rows
+            if all(
+                query.matches(condition, row[name])
+                for name, condition in conditions.items()
+            )
+            and all(condition.matches(row) for condition in filters)
+        ]
+        for ordering in reversed(orderings):
+            rows.sort(
+                key=lambda row: row[ordering.column_name],
+                reverse=not ordering.ascending,
+            )
+        return SearchResults(rows)
+
+    def get(self, *args, **conditions):
+        rows = self.search(*args, **conditions)
+        if len(rows) > 1:
+            raise ValueError("More than one row matched")
+        return rows[0] if rows else None
+
+    def delete_all_rows(self):
+        self.rows.clear()
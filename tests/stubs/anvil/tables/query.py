@@ -0,0 +1,90 @@
+"""Query operators which can be evaluated against the in-memory tables"""
+
+import re
+
+
+class Query:
+    """A condition on a single column value"""
+
+    def __init__(self, test):
+        self.test = test
+
+    def matches(self, value):
+        return self.test(value)
+
+
+class FetchOnly:
+    """Which columns to fetch. The in-memory tables always hold every column."""
+
+    def __init__(self, *columns, **linked):
+        self.columns = columns
+        self.linked = linked
+
+
+def matches(condition, value):
+    """Return whether a column value satisfies a search condition"""
+    if isinstance(condition, Query):
+        return condition.matches(value)
+    return _same(condition, value)
+
+
+def _same(expected, value):
+    if hasattr(expected, "get_id") and hasattr(value, "get_id"):
+        return expected.get_id() == value.get_id()
+    if isinstance(value, list) and not isinstance(expected, list):
+        # A search for a row matches any list of rows which includes it
+        return any(_same(expected, member) for member in value)
+    return expected == value
+
+
+def all_of(*conditions):
+    return Query(lambda value: all(matches(c, value) for c in conditions))
+
+
+def any_of(*conditions):
+    return Query(lambda value: any(matches(c, value) for c in conditions))
+
+
+def none_of(*conditions):
+    return Query(lambda value: not any(matches(c, value) for c in conditions))
+
+
+def not_(*conditions):
+    return none_of(*conditions)
+
+
+def greater_than(bound):
+    return Query(lambda value: value is not None and value > bound)
+
+
+def greater_than_or_equal_to(bound):
+    return Query(lambda value: value is not None and value >= bound)
+
+
+def less_than(bound):
+    return Query(lambda value: value is not None and value < bound)
+
+
+def less_than_or_equal_to(bound):
+    return Query(lambda value: value is not None and value <= bound)
+
+
+def _pattern(pattern, flags=0):
+    expression = re.escape(pattern).replace("%", ".*").replace("_", ".")
+    return re.compile(f"^{expression}$", flags)
+
+
+def like(pattern):
+    return Query(lambda value: bool(_pattern(pattern).match(value or "")))
+
+
+def ilike(pattern):
+    return Query(lambda value: bool(_pattern(pattern, re.I).match(value or "")))
+
+
+def full_text_match(text):
+    return Query(lambda value: text.lower() in (value or "").lower())
+
+
+def fetch_only(*columns, **linked):
+    return FetchOnly(*columns, **linked)
@@ -0,0 +1 @@
+"""A stand-in for the app package in which an Anvil app defines its models"""
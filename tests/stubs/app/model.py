@@ -0,0 +1 @@
+"""Model classes are set as attributes by the code which uses them"""
@@ -0,0 +1,39 @@
+from anvil.server import Capability, PermissionDenied
+
+import pytest
+from orm_server.persistence import _require_capability
+
+
+def test_single_object_capability_covers_its_object():
+    _require_capability(Capability(["Book", "b1"]), "Book", "b1")
+
+
+def test_single_object_capability_rejects_another_object():
+    with pytest.raises(PermissionDenied):
+        _require_capability(Capability(["Book", "b1"]), "Book", "b2")
+
+
+def test_single_object_capability_rejects_another_class():
+    with pytest.raises(PermissionDenied):
+        _require_capability(Capability(["Author", "b1"]), "Book", "b1")
+
+
+def test_page_capability_covers_its_objects():
+    capability = Capability(["Book", ["b1", "b2"]])
+    _require_capability(capability, "Book", "b1")
+    _require_capability(capability, "Book", "b2")
+
+
+def test_page_capability_rejects_an_object_outside_its_scope():
+    with pytest.raises(ValueError):
+        _require_capability(Capability(["Book", ["b1", "b2"]]), "Book", "b3")
+
+
+def test_page_capability_rejects_another_class():
+    with pytest.raises(PermissionDenied):
+        _require_capability(Capability(["Author", ["b1"]]), "Book", "b1")
+
+
+def test_missing_capability_is_rejected():
+    with pytest.raises(PermissionDenied):
+        _require_capability(None, "Book", "b1")
@@ -0,0 +1,81 @@
+import pytest
+from app import model
+from orm_client import particles
+from orm_client.cache import Cache
+from orm_client.particles import Attribute, Relationship, model_type
+
+
+@model_type
+class Tag:
+    name = Attribute()
+
+
+@model_type
+class Author:
+    name = Attribute()
+    tags = Relationship("Tag", required=False, with_many=True)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Record server calls and answer searches for authors"""
+    calls = []
+    authors = [
+        Author(uid="a1", name="Ann", tags=[Tag(uid="t1", name="poetry")]),
+        Author(uid="a2", name="Bob", tags=[]),
+    ]
+    for author in authors:
+        particles._mark_clean(author)
+
+    def call(function_name, *args, **kwargs):
+        calls.append(function_name)
+        if function_name == "get_object":
+            return next(author for author in authors if author.uid == args[2])
+
+    monkeypatch.setattr(particles, "_call", call)
+    monkeypatch.setattr(Author, "search", classmethod(lambda cls, **_: authors))
+    monkeypatch.setattr(model, "Author", Author, raising=False)
+    cache = Cache()
+    monkeypatch.setattr(particles, "object_cache", cache)
+    cache.refresh("Author")
+    return calls
+
+
+def test_get_is_served_from_the_cache(server):
+    assert Author.get("a1", max_depth=1).name == "Ann"
+    assert server == []
+
+
+def test_unsaved_changes_are_not_returned_by_the_next_get(server):
+    author = Author.get("a1", max_depth=1)
+    author.name = "Changed"
+    author.tags.append(Tag(uid="t2", name="drama"))
+
+    author = Author.get("a1", max_depth=1)
+    assert author.name == "Ann"
+    assert [tag.uid for tag in author.tags] == ["t1"]
+    assert author._changed_members() == set()
+
+
+def test_deleted_objects_are_not_served(server):
+    Author.delete_many([Author.get("a2", max_depth=1)])
+
+    Author.get("a2", max_depth=1)
+    assert server == ["delete_objects", "get_object"]
+
+
+def test_saved_objects_are_fetched_again(server):
+    Author.save_many([Author.get("a1", max_depth=1)])
+
+    Author.get("a1", max_depth=1)
+    Author.get("a2", max_depth=1)
+    assert server == ["save_objects", "get_object"]
+
+
+def test_delete_where_clears_the_model(server):
+    Author.delete_where(name="Ann")
+
+    Author.get("a2", max_depth=1)
+    assert server == ["delete_where", "get_object"]
+    with pytest.raises(KeyError):
+        particles.object_cache["Author"]
@@ -0,0 +1,95 @@
+from itertools import count
+
+from orm_client.particles import Attribute, Relationship, model_type
+from orm_server.persistence import _CrossReferences
+
+row_ids = count()
+
+
+class Row(dict):
+    """A stand-in data tables row which counts its writes"""
+
+    def __init__(self, **columns):
+        super().__init__(columns)
+        self.row_id = f"[1,{next(row_ids)}]"
+        self.writes = 0
+
+    def get_id(self):
+        return self.row_id
+
+    def update(self, **columns):
+        self.writes += 1
+        super().update(columns)
+
+
+@model_type
+class Author:
+    version_column = "updated_at"
+    name = Attribute()
+    books = Relationship("Book", required=False, with_many=True)
+
+
+@model_type
+class Book:
+    title = Attribute()
+    author = Relationship("Author", required=False, cross_reference="books")
+
+
+def _author_row(uid, books=()):
+    return Row(uid=uid, name=uid, books=list(books), updated_at=None)
+
+
+def _relink(book_row, new_author_row):
+    book = Book(uid=book_row["uid"], title="T", author=None)
+    cross_references = _CrossReferences()
+    cross_references.relink(book, book_row, {"author": new_author_row})
+    cross_references.apply()
+
+
+def test_moving_a_child_relinks_both_parents():
+    book_row = Row(uid="b1", title="T", author=None)
+    old_author = _author_row("a1", [book_row])
+    new_author = _author_row("a2")
+    book_row["author"] = old_author
+
+    _relink(book_row, new_author)
+
+    assert old_author["books"] == []
+    assert new_author["books"] == [book_row]
+    assert old_author["updated_at"] is not None
+    assert new_author["updated_at"] is not None
+
+
+def test_unlinking_a_child_removes_it_from_its_parent():
+    book_row = Row(uid="b1", title="T", author=None)
+    other_row = Row(uid="b2", title="T", author=None)
+    old_author = _author_row("a1", [book_row, other_row])
+    book_row["author"] = old_author
+
+    _relink(book_row, None)
+
+    assert old_author["books"] == [other_row]
+
+
+def test_parent_is_not_written_when_links_are_unchanged():
+    book_row = Row(uid="b1", title="T", author=None)
+    author = _author_row("a1", [book_row])
+    book_row["author"] = author
+
+    _relink(book_row, author)
+
+    assert author.writes == 0
+    assert author["updated_at"] is None
+
+
+def test_parent_of_many_children_is_written_once():
+    author = _author_row("a1")
+    book_rows = [Row(uid=f"b{n}", title="T", author=None) for n in range(3)]
+    cross_references = _CrossReferences()
+    for book_row in book_rows:
+        book = Book(uid=book_row["uid"], title="T", author=None)
+        cross_references.relink(book, book_row, {"author": author})
+    cross_references.apply()
+
+    assert author.writes == 1
+    assert author["books"] == book_rows
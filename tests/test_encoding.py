@@ -0,0 +1,80 @@
+from orm_client.particles import (
+    Attribute,
+    Relationship,
+    _decode_page,
+    _encode_page,
+    model_type,
+)
+
+
+@model_type
+class Author:
+    name = Attribute()
+
+
+@model_type
+class Book:
+    title = Attribute()
+    author = Relationship("Author", required=False)
+    editors = Relationship("Author", required=False, with_many=True)
+
+
+def _round_trip(instances):
+    return _decode_page(_encode_page(instances))
+
+
+def test_round_trip_keeps_members_and_state(tables):
+    authors = tables("author", name="string")
+    books = tables(
+        "book", title="string", author="link_single", editors="link_multiple"
+    )
+    ann = authors.add_row(uid="a1", name="Ann")
+    row = books.add_row(uid="b1", title="T", author=ann, editors=[ann])
+    book = Book._from_row(row, max_depth=1)
+
+    decoded = _round_trip([book])[0]
+
+    assert type(decoded) is Book
+    assert (decoded.uid, decoded.title) == ("b1", "T")
+    assert decoded._row_id == row.get_id()
+    assert (decoded.author.uid, decoded.author.name) == ("a1", "Ann")
+    assert decoded._changed_members() == set()
+
+
+def test_shared_related_object_is_sent_once():
+    ann = Author(uid="a1", name="Ann")
+    first = Book(uid="b1", title="T", author=ann, editors=[ann])
+    second = Book(uid="b2", title="U", author=ann)
+
+    page = _encode_page([first, second])
+    decoded = _decode_page(page)
+
+    assert len(page["rows"]) == 3
+    assert decoded[0].author is decoded[1].author
+    assert decoded[0].editors[0] is decoded[0].author
+
+
+def test_placeholder_keeps_only_its_row_id(tables):
+    authors = tables("author", name="string")
+    row = authors.add_row(uid="a1", name="Ann")
+    book = Book(uid="b1", title="T", author=Author._stub(row))
+
+    decoded = _round_trip([book])[0].author
+
+    assert object.__getattribute__(decoded, "_row_id") == row.get_id()
+    assert set(decoded._deferred) == {"uid", "name"}
+    assert "uid" not in vars(decoded)
+
+
+def test_partial_instance_keeps_its_deferred_members(tables):
+    books = tables(
+        "book", title="string", author="link_single", editors="link_multiple"
+    )
+    row = books.add_row(uid="b1", title="T", author=None, editors=[])
+    book = Book._from_row(row, fields=["title"])
+
+    decoded = _round_trip([book])[0]
+
+    assert decoded.title == "T"
+    assert set(decoded._deferred) == {"author", "editors"}
+    assert "author" not in vars(decoded)
@@ -0,0 +1,76 @@
+import pytest
+from orm_client.particles import Attribute, Relationship, model_type
+from orm_server import persistence
+
+
+class Row(dict):
+    """A stand-in data tables row which records the columns read from it"""
+
+    def __init__(self, **columns):
+        super().__init__(columns)
+        self.read = set()
+
+    def get_id(self):
+        return dict.__getitem__(self, "uid")
+
+    def __getitem__(self, name):
+        self.read.add(name)
+        return super().__getitem__(name)
+
+
+class SerialExecutor:
+    def map(self, function, *iterables):
+        return map(function, *iterables)
+
+
+@model_type
+class Publisher:
+    name = Attribute()
+
+
+@model_type
+class Author:
+    name = Attribute()
+    publisher = Relationship("Publisher", required=False)
+
+
+@model_type
+class Book:
+    title = Attribute()
+    author = Relationship("Author", required=False)
+
+
+@pytest.fixture
+def rows(monkeypatch):
+    monkeypatch.setattr(persistence, "hydration_executor", SerialExecutor())
+    publisher = Row(uid="p1", name="Pub", logo=b"...")
+    author = Row(uid="a1", name="Ann", publisher=publisher, photo=b"...")
+    book = Row(uid="b1", title="T", author=author)
+    return book, author, publisher
+
+
+def test_only_the_model_columns_of_linked_rows_are_read(rows):
+    book, author, publisher = rows
+
+    persistence._prefetch(Book, [book], max_depth=2)
+
+    assert author.read == {"uid", "name", "publisher"}
+    assert publisher.read == {"uid", "name"}
+
+
+def test_preloaded_rows_are_not_loaded_again(rows):
+    book, author, publisher = rows
+
+    persistence._prefetch(Book, [book], max_depth=2, preload=["author"])
+
+    assert author.read == {"publisher"}
+    assert publisher.read == {"uid", "name"}
+
+
+def test_relationships_outside_fields_are_not_followed(rows):
+    book, author, publisher = rows
+
+    persistence._prefetch(Book, [book], max_depth=2, fields=["title"])
+
+    assert author.read == set()
+    assert publisher.read == set()
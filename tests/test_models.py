@@ -0,0 +1,84 @@
+from copy import copy
+
+import pytest
+from orm_client.particles import Attribute, Relationship, model_type
+
+
+def test_slots_instance_is_copied_through_its_slots():
+    @model_type(slots=True)
+    class Author:
+        name = Attribute()
+
+    author = Author(uid="a1", name="Ann")
+    author.update_capability = "capability"
+    duplicate = copy(author)
+
+    assert duplicate is not author
+    assert (duplicate.uid, duplicate.name) == ("a1", "Ann")
+    assert duplicate.update_capability == "capability"
+    assert duplicate.delete_capability is None
+
+
+@pytest.mark.parametrize("name", ["count", "get", "save", "search", "export"])
+def test_slots_member_with_the_name_of_a_method_is_rejected(name):
+    members = {"title": Attribute(), name: Attribute()}
+    with pytest.raises(AttributeError, match=f"Book.{name} cannot be held"):
+        model_type(type("Book", (), members), slots=True)
+
+
+def test_member_with_the_name_of_a_method_is_allowed_without_slots():
+    Book = model_type(type("Book", (), {"count": Attribute()}))
+    assert Book(count=3).count == 3
+
+
+class Row(dict):
+    """A stand-in data tables row"""
+
+    def get_id(self):
+        return "[1," + self["uid"] + "]"
+
+
+@model_type
+class Tag:
+    name = Attribute()
+
+
+@model_type
+class Article:
+    title = Attribute()
+    tags = Relationship("Tag", required=False, with_many=True)
+
+
+def test_hydrated_instance_starts_clean_and_tracks_changes():
+    tag = Row(uid="t1", name="poetry")
+    article = Article._from_row(Row(uid="a1", title="T", tags=[tag]), max_depth=1)
+
+    assert article._row_id == "[1,a1]"
+    assert article._changed_members() == set()
+    article.title = "Changed"
+    article.tags.append(Tag(uid="t2", name="drama"))
+    assert article._changed_members() == {"title", "tags"}
+
+
+def test_constructed_instance_is_not_tracked():
+    article = Article(uid="a1", title="T")
+    article.title = "Changed"
+    assert article._changed_members() is None
+
+
+@pytest.mark.parametrize(
+    "create",
+    [
+        lambda cls: cls(uid="b1", title="T"),
+        lambda cls: cls._from_row(Row(uid="b1", title="T")),
+        lambda cls: cls._from_row(Row(uid="b1", title="T"), fields=["title"]),
+    ],
+)
+def test_slots_instance_state_is_set_when_created(create):
+    @model_type(slots=True)
+    class Book:
+        title = Attribute()
+
+    book = create(Book)
+    for name in ["_row_id", "_deferred", "_changes", "_snapshot", "update_capability"]:
+        object.__getattribute__(book, name)
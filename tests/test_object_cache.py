@@ -0,0 +1,118 @@
+from orm_client.particles import Attribute, Relationship, model_type
+from orm_server.cache import ObjectCache
+
+
+@model_type
+class Author:
+    name = Attribute()
+
+
+@model_type
+class Book:
+    isbn = Attribute(is_uid=True)
+    title = Attribute(required=False)
+    author = Relationship("Author", required=False)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ObjectCache(max_entries=2)
+    cache.put("Author", "a1", 1, Author(uid="a1", name="Ann"))
+    cache.put("Author", "a2", 1, Author(uid="a2", name="Bob"))
+    assert cache.get("Author", "a1", 1) is not None
+    cache.put("Author", "a3", 1, Author(uid="a3", name="Cat"))
+
+    assert cache.get("Author", "a2", 1) is None
+    assert cache.get("Author", "a1", 1).name == "Ann"
+    assert cache.get("Author", "a3", 1).name == "Cat"
+    assert cache.stats()["size"] == 2
+
+
+def test_hits_are_copies_without_capabilities():
+    cache = ObjectCache()
+    author = Author(uid="a1", name="Ann")
+    author.update_capability = "capability"
+    cache.put("Author", "a1", 1, author)
+
+    hit = cache.get("Author", "a1", 1)
+    assert hit is not author
+    assert hit.update_capability is None
+    assert author.update_capability == "capability"
+
+
+def test_entry_is_invalidated_by_uid_and_unique_identifier():
+    for key in ["b1", "978-0"]:
+        cache = ObjectCache()
+        # get_object caches by the unique identifier it was asked for, which need
+        # not be the uid
+        cache.put("Book", "978-0", None, Book(uid="b1", isbn="978-0", title="T"))
+        cache.invalidate("Book", key)
+        assert cache.get("Book", "978-0", None) is None
+        assert cache.stats()["size"] == 0
+
+
+def test_evicted_entry_leaves_no_keys_behind():
+    cache = ObjectCache(max_entries=1)
+    author = Author(uid="a1", name="Ann")
+    cache.put("Book", "978-0", 1, Book(uid="b1", isbn="978-0", author=author))
+    cache.put("Author", "a2", 1, Author(uid="a2", name="Bob"))
+
+    assert cache._keys_by_object == {("Author", "a2"): {("Author", "a2", 1)}}
+    assert cache._dependents == {}
+
+
+def test_invalidating_an_object_invalidates_entries_embedding_it():
+    cache = ObjectCache()
+    ann = Author(uid="a1", name="Ann")
+    cache.put("Author", "a1", 1, ann)
+    cache.put("Book", "978-0", 1, Book(uid="b1", isbn="978-0", author=ann))
+    cache.put("Book", "978-1", 1, Book(uid="b2", isbn="978-1", author=None))
+
+    cache.invalidate("Author", "a1")
+
+    assert cache.get("Author", "a1", 1) is None
+    assert cache.get("Book", "978-0", 1) is None
+    assert cache.get("Book", "978-1", 1) is not None
+
+
+def test_invalidating_a_class_invalidates_entries_embedding_it():
+    cache = ObjectCache()
+    cache.put("Book", "978-0", 1, Book(uid="b1", isbn="978-0", author=None))
+    cache.put(
+        "Book",
+        "978-1",
+        1,
+        Book(uid="b2", isbn="978-1", author=Author(uid="a1", name="Ann")),
+    )
+
+    cache.invalidate_class("Author")
+
+    assert cache.get("Book", "978-0", 1) is not None
+    assert cache.get("Book", "978-1", 1) is None
+
+
+def test_expired_entry_is_a_miss(monkeypatch):
+    from orm_server import cache as cache_module
+
+    now = [100.0]
+    monkeypatch.setattr(cache_module, "monotonic", lambda: now[0])
+    cache = ObjectCache(ttl=60)
+    cache.put("Author", "a1", 1, Author(uid="a1", name="Ann"))
+
+    now[0] = 160.0
+    assert cache.get("Author", "a1", 1) is not None
+    now[0] = 161.0
+    assert cache.get("Author", "a1", 1) is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 0}
+    assert cache._keys_by_object == {}
+
+
+def test_entries_without_ttl_do_not_expire(monkeypatch):
+    from orm_server import cache as cache_module
+
+    now = [100.0]
+    monkeypatch.setattr(cache_module, "monotonic", lambda: now[0])
+    cache = ObjectCache(ttl=None)
+    cache.put("Author", "a1", 1, Author(uid="a1", name="Ann"))
+
+    now[0] = 10000.0
+    assert cache.get("Author", "a1", 1) is not None
@@ -0,0 +1,141 @@
+import pytest
+from orm_client.instrumentation import Stats
+from orm_client.particles import Attribute, Relationship, model_type
+from orm_server import persistence
+
+
+@model_type
+class Author:
+    name = Attribute()
+    books = Relationship("Book", required=False, with_many=True)
+
+
+@model_type
+class Tag:
+    name = Attribute()
+
+
+@model_type
+class Book:
+    title = Attribute()
+    author = Relationship("Author", required=False, cross_reference="books")
+    tags = Relationship("Tag", required=False, with_many=True)
+
+
+@pytest.fixture
+def library(tables):
+    library = {
+        "authors": tables("author", name="string", books="link_multiple"),
+        "books": tables(
+            "book", title="string", author="link_single", tags="link_multiple"
+        ),
+        "tags": tables("tag", name="string"),
+    }
+    ann = library["authors"].add_row(uid="a1", name="Ann", books=[])
+    library["authors"].add_row(uid="a2", name="Bob", books=[])
+    for n in range(3):
+        row = library["books"].add_row(uid=f"b{n}", title=f"Book {n}", author=ann)
+        ann["books"] = ann["books"] + [row]
+    library["tags"].add_row(uid="t1", name="poetry")
+    return library
+
+
+def _get(class_name, uid, max_depth=0):
+    return persistence.get_object(class_name, __name__, uid, max_depth)
+
+
+def _row(table, uid):
+    return table.get(uid=uid)
+
+
+def test_related_rows_are_found_with_one_search_per_class(library):
+    book = _get("Book", "b0")
+    book.author = _get("Author", "a2")
+    book.tags = [_get("Tag", "t1")]
+
+    related_rows = persistence._related_rows([book])
+    members, single_relationships = persistence._members(book, related_rows)
+
+    assert set(related_rows) == {("Author", "a2"), ("Tag", "t1")}
+    assert members == {
+        "author": _row(library["authors"], "a2"),
+        "tags": [_row(library["tags"], "t1")],
+    }
+    assert single_relationships == {"author": _row(library["authors"], "a2")}
+
+
+def test_placeholders_are_found_by_row_id(library):
+    bob = _row(library["authors"], "a2")
+    book = _get("Book", "b0")
+    book.author = Author._stub(bob)
+
+    related_rows = persistence._related_rows([book])
+
+    assert related_rows == {("Author", "row", bob.get_id()): bob}
+
+
+def test_only_changed_rows_are_updated(library):
+    books = [_get("Book", f"b{n}") for n in range(3)]
+    books[1].title = "Changed"
+    writes = library["books"].writes
+
+    persistence.save_objects("Book", books)
+
+    assert _row(library["books"], "b1")["title"] == "Changed"
+    assert _row(library["books"], "b0")["title"] == "Book 0"
+    assert library["books"].writes == writes + 1
+    assert all(book._changed_members() == set() for book in books)
+
+
+def test_new_instances_are_added_with_capabilities(library):
+    new = [Book(title="New 1"), Book(title="New 2", author=_get("Author", "a2"))]
+
+    results = persistence.save_objects("Book", new)
+
+    assert [book.uid for book in new] == [None, None]
+    assert [_row(library["books"], book.uid)["title"] for book in results] == [
+        "New 1",
+        "New 2",
+    ]
+    for book in results:
+        assert book.update_capability.scope == ["Book", book.uid]
+        assert book.delete_capability.scope == ["Book", book.uid]
+    bob = _row(library["authors"], "a2")
+    assert bob["books"] == [_row(library["books"], results[1].uid)]
+
+
+def test_table_calls_of_a_bulk_save_are_counted(library):
+    books = [_get("Book", "b0"), Book(title="New 1"), Book(title="New 2")]
+    books[0].title = "Changed"
+
+    with Stats() as stats:
+        persistence.save_objects("Book", books)
+
+    assert stats.counters == {"table.search": 1, "table.add_rows": 1}
+
+
+def test_bulk_save_relinks_each_parent_once(library):
+    bob = _get("Author", "a2")
+    books = [_get("Book", f"b{n}") for n in range(3)]
+    for book in books[:2]:
+        book.author = bob
+    writes = library["authors"].writes
+
+    persistence.save_objects("Book", books)
+
+    ann_row = _row(library["authors"], "a1")
+    bob_row = _row(library["authors"], "a2")
+    assert [row["uid"] for row in ann_row["books"]] == ["b2"]
+    assert [row["uid"] for row in bob_row["books"]] == ["b0", "b1"]
+    assert library["authors"].writes == writes + 2
+
+
+def test_save_object_updates_only_changed_columns(library):
+    book = _get("Book", "b0")
+    book.title = "Changed"
+
+    persistence.save_object(book)
+
+    row = _row(library["books"], "b0")
+    assert row["title"] == "Changed"
+    assert row["author"]["uid"] == "a1"
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta, timezone
+
+import anvil.tables.query as q
+
+import pytest
+from orm_client.particles import Attribute, Relationship, model_type
+from orm_server import persistence
+
+
+@model_type
+class Author:
+    name = Attribute()
+
+
+@model_type
+class Book:
+    title = Attribute()
+    author = Relationship("Author", required=False)
+
+
+@pytest.fixture
+def books(tables):
+    authors = tables("author", name="string")
+    books = tables("book", title="string", author="link_single")
+    ann = authors.add_row(uid="a1", name="Ann")
+    for n in range(7):
+        books.add_row(uid=f"b{n}", title=f"Book {n}", author=ann)
+    return books
+
+
+def _search(class_name="Book", page_length=3, **options):
+    return persistence.basic_search(
+        class_name, __name__, page_length, None, False, **options
+    )
+
+
+def _titles(page):
+    return [book.title for book in page]
+
+
+def test_pages_cover_every_result_once(books):
+    results = _search()
+    pages = [
+        persistence.fetch_objects("Book", __name__, results.rows_id, page, 3)
+        for page in range(3)
+    ]
+
+    assert [_titles(page[0]) for page in pages] == [
+        ["Book 0", "Book 1", "Book 2"],
+        ["Book 3", "Book 4", "Book 5"],
+        ["Book 6"],
+    ]
+    assert [page[1] for page in pages] == [False, False, True]
+
+
+@pytest.mark.parametrize(
+    "limit, expected",
+    [
+        (5, [(["Book 0", "Book 1", "Book 2"], False), (["Book 3", "Book 4"], True)]),
+        (
+            6,
+            [
+                (["Book 0", "Book 1", "Book 2"], False),
+                (["Book 3", "Book 4", "Book 5"], True),
+            ],
+        ),
+        (3, [(["Book 0", "Book 1", "Book 2"], True), ([], True)]),
+        (0, [([], True), ([], True)]),
+    ],
+)
+def test_query_limit_cuts_the_pages_short(books, limit, expected):
+    results = _search(query={"order_by": [["title", True]], "limit": limit})
+    pages = [
+        persistence.fetch_objects("Book", __name__, results.rows_id, page, 3)
+        for page in range(2)
+    ]
+
+    assert [(_titles(page[0]), page[1]) for page in pages] == expected
+    assert len(results) == min(limit, 7)
+
+
+def test_cursor_pages_follow_on_and_respect_the_limit(books):
+    results = _search(cursor=True, query={"limit": 5})
+    first = persistence.fetch_objects("Book", __name__, results.rows_id, 0, 3)
+    second = persistence.fetch_objects(
+        "Book", __name__, results.rows_id, 1, 3, after=first[2]
+    )
+
+    assert (_titles(first[0]), first[1]) == (["Book 0", "Book 1", "Book 2"], False)
+    assert (_titles(second[0]), second[1]) == (["Book 3", "Book 4"], True)
+
+
+def test_page_is_hydrated_as_the_class_that_was_searched(books):
+    results = _search()
+
+    page = persistence.fetch_objects("Author", __name__, results.rows_id, 0, 3)[0]
+
+    assert [type(book) for book in page] == [Book, Book, Book]
+    assert page[0].update_capability.scope == ["Book", "b0"]
+
+
+@model_type
+class Shelf:
+    label = Attribute()
+
+
+def test_get_table_compiles_a_registered_class(tables):
+    shelves = tables("shelf", label="string")
+
+    assert persistence.get_table("Shelf") is shelves
+    assert persistence._schemas["Shelf"] == {"cls": Shelf, "table": shelves}
+
+
+@model_type
+class Notice:
+    version_column = "updated_at"
+    text = Attribute()
+
+
+def test_sync_reports_only_readable_removals(tables, monkeypatch):
+    since = datetime.now(timezone.utc) - timedelta(minutes=1)
+    later = since + timedelta(seconds=10)
+    notices = tables("notice", text="string", updated_at="datetime")
+    for uid, text in [("n1", "kept"), ("n2", "hidden"), ("n3", "secret")]:
+        notices.add_row(uid=uid, text=text, updated_at=later)
+    tombstones = tables("orm_tombstone", class_name="string", deleted_at="datetime")
+    for uid in ["n4", "n5"]:
+        tombstones.add_row(uid=uid, class_name="Notice", deleted_at=later)
+    monkeypatch.setattr(
+        persistence.security,
+        "has_read_permission_many",
+        lambda class_name, uids: {uid for uid in uids if uid in {"n1", "n2", "n4"}},
+    )
+
+    objects, removed, _ = persistence.sync_objects(
+        "Notice", __name__, since, text=q.not_("hidden")
+    )
+
+    assert [notice.uid for notice in objects] == ["n1"]
+    assert removed == ["n2", "n4"]